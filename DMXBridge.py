@@ -0,0 +1,369 @@
+#!python3
+# DMXBridge.py
+# UDP input bridge for sACN (E1.31) and Art-Net lighting desks.
+#
+# INSTRUCTIONS FOR USE: (in general....)
+# Enable the bridge in /LEDControllerSettings.ini (DMXEnabled = yes) and point the lighting desk at
+# this machine. The bridge listens on a background thread and only ever keeps the most recent frame
+# for each universe - the controller picks that frame up whenever the Arduino asks for its next
+# command, so the desk can send as fast as it likes without queueing work for the serial link.
+#
+# Run this file directly to loop a local UDP sender back into a bridge and print the counters.
+
+import logging # Program logging
+import socket # UDP receive
+import struct # Building test packets
+import threading # Background receive thread
+import time # for delays, etc.
+
+SACN_PORT = 5568
+ARTNET_PORT = 6454
+
+# Largest packet either protocol will send for a full 512 channel universe (sACN is 638 bytes).
+MAX_PACKET = 638
+DMX_CHANNELS = 512
+
+# sACN (E1.31) layout - offsets into the UDP payload.
+ACN_PACKET_ID = b'ASC-E1.17\x00\x00\x00'
+SACN_ID_OFFSET = 4
+SACN_ROOT_LENGTH = 16      # flags and length (low 12 bits) of each PDU - counted from the PDU start
+SACN_ROOT_VECTOR = 18      # 4 bytes, 0x00000004 for E1.31 data
+SACN_FRAME_LENGTH = 38
+SACN_FRAME_VECTOR = 40     # 4 bytes, 0x00000002 for DMP data
+SACN_SEQUENCE = 111
+SACN_OPTIONS = 112         # bit 6 = stream terminated, bit 7 = preview data
+SACN_UNIVERSE = 113        # 2 bytes, big endian
+SACN_DMP_LENGTH = 115
+SACN_DMP_VECTOR = 117      # 0x02
+SACN_PROPERTY_COUNT = 123  # 2 bytes, big endian, includes the start code
+SACN_START_CODE = 125
+SACN_DATA = 126
+SACN_OPT_PREVIEW = 0x80
+SACN_OPT_TERMINATED = 0x40
+
+# Art-Net layout - offsets into the UDP payload.
+ARTNET_ID = b'Art-Net\x00'
+ARTNET_OPCODE = 8          # 2 bytes, little endian
+ARTNET_OP_DMX = 0x5000
+ARTNET_SEQUENCE = 12
+ARTNET_UNIVERSE = 14       # SubUni (low byte) then Net (high byte)
+ARTNET_LENGTH = 16         # 2 bytes, big endian
+ARTNET_DATA = 18
+
+
+class DMXFrame(object):
+    """Latest DMX data received for one universe.
+
+    The data buffer is allocated once and overwritten in place by the receive thread."""
+
+    def __init__(self, universe):
+        self.universe = universe
+        self.data = bytearray(DMX_CHANNELS)
+        self.length = 0
+        self.sequence = -1
+        self.fresh = False
+        self.received = 0 # packets accepted into this frame
+        self.merged = 0   # frames overwritten before they were consumed
+
+
+class DMXBridge(object):
+    """Listens for sACN or Art-Net packets and keeps the latest frame per universe.
+
+    protocol: 'sacn' or 'artnet'
+    universes: iterable of universe numbers to accept - everything else is counted and dropped
+    """
+
+    def __init__(self, protocol='sacn', universes=(1,), address='', port=None):
+        self.protocol = protocol.lower()
+        if self.protocol not in ('sacn', 'artnet'):
+            raise ValueError('Invalid DMX protocol: {0}'.format(protocol))
+        self.address = address
+        if port is None:
+            port = SACN_PORT if self.protocol == 'sacn' else ARTNET_PORT
+        self.port = port
+        self.frames = {universe: DMXFrame(universe) for universe in universes}
+        self.packets = 0
+        self.dropped = 0
+        self.sock = None
+        self.lock = threading.Lock()
+        # Results of the last parse - kept on the bridge rather than returned so that parsing a
+        # packet doesn't build a tuple.
+        self._universe = 0
+        self._sequence = 0
+        self._length = 0
+        self.running = False
+        self.thread = None
+        # Receive buffer and the views into it are created once so that the receive loop does
+        # not allocate per packet - DMX data is copied straight from here into the frame buffer.
+        self._buffer = bytearray(MAX_PACKET)
+        self._view = memoryview(self._buffer)
+        if self.protocol == 'sacn':
+            self._data_view = self._view[SACN_DATA:SACN_DATA + DMX_CHANNELS]
+        else:
+            self._data_view = self._view[ARTNET_DATA:ARTNET_DATA + DMX_CHANNELS]
+
+    def start(self):
+        """Open the UDP socket and start the receive thread."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.address, self.port))
+        self.port = self.sock.getsockname()[1] # port 0 picks a free port
+        self.sock.settimeout(0.25) # so the thread notices stop()
+        if self.protocol == 'sacn' and self.address in ('', '0.0.0.0'):
+            # sACN is normally multicast to 239.255.<universe high>.<universe low>
+            for universe in self.frames:
+                group = socket.inet_aton('239.255.{0}.{1}'.format(universe >> 8, universe & 0xFF))
+                mreq = struct.pack('4s4s', group, socket.inet_aton('0.0.0.0'))
+                try:
+                    self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+                except OSError as e:
+                    logging.warning("DMXBridge: unable to join sACN multicast for universe {0}: {1!r}"
+                        .format(universe, e))
+        self.running = True
+        self.thread = threading.Thread(target=self._receive_loop, name='DMXBridge', daemon=True)
+        self.thread.start()
+        logging.info("DMXBridge listening for {0} on port {1}, universes {2}."
+            .format(self.protocol, self.port, sorted(self.frames)))
+
+    def stop(self):
+        """Stop the receive thread and close the socket."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        logging.info("DMXBridge stopped. {0}".format(self.stats()))
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                size = self.sock.recv_into(self._buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                continue
+            self.handle_packet(size)
+
+    # Parses the packet currently sitting in the receive buffer. Split out from the receive loop
+    # so that it can be driven without a socket.
+    def handle_packet(self, size):
+        """Validate the packet in the receive buffer and store its DMX data. Returns True if kept."""
+        self.packets += 1
+        if self.protocol == 'sacn':
+            valid = self._parse_sacn(size)
+        else:
+            valid = self._parse_artnet(size)
+        frame = self.frames.get(self._universe)
+        if frame is None or not valid:
+            self.dropped += 1
+            return False
+        sequence = self._sequence
+        with self.lock:
+            # Sequence numbers wrap at 256 - anything that lands just behind the last sequence
+            # seen is a late, out of order packet and would only roll the strip backwards.
+            # (Art-Net uses sequence 0 to mean sequencing is disabled.)
+            checked = frame.sequence >= 0 and (self.protocol == 'sacn' or sequence != 0)
+            if checked and -20 < ((sequence - frame.sequence + 128) % 256) - 128 <= 0:
+                self.dropped += 1
+                return False
+            if frame.fresh:
+                frame.merged += 1
+            frame.data[:] = self._data_view
+            frame.length = self._length
+            frame.sequence = sequence
+            frame.fresh = True
+            frame.received += 1
+        return True
+
+    # Length field (low 12 bits of flags and length) of the sACN PDU starting at offset.
+    def _pdu_length(self, offset):
+        return ((self._buffer[offset] & 0x0F) << 8) | self._buffer[offset + 1]
+
+    # Validates the packet and stores its universe, sequence and channel count on the bridge.
+    # Returns False if the packet is invalid.
+    def _parse_sacn(self, size):
+        buf = self._buffer
+        if (size < SACN_DATA or buf.find(ACN_PACKET_ID, SACN_ID_OFFSET, SACN_ID_OFFSET + 12) != SACN_ID_OFFSET
+                or buf[SACN_ROOT_VECTOR + 3] != 0x04 or buf[SACN_FRAME_VECTOR + 3] != 0x02
+                or buf[SACN_DMP_VECTOR] != 0x02 or buf[SACN_START_CODE] != 0
+                or buf[SACN_OPTIONS] & (SACN_OPT_PREVIEW | SACN_OPT_TERMINATED)):
+            return False
+        # Each PDU runs to the end of the packet, and the DMP layer holds exactly the properties.
+        count = (buf[SACN_PROPERTY_COUNT] << 8) | buf[SACN_PROPERTY_COUNT + 1]
+        if (self._pdu_length(SACN_ROOT_LENGTH) != size - SACN_ROOT_LENGTH
+                or self._pdu_length(SACN_FRAME_LENGTH) != size - SACN_FRAME_LENGTH
+                or self._pdu_length(SACN_DMP_LENGTH) != size - SACN_DMP_LENGTH
+                or count != size - SACN_START_CODE or count > DMX_CHANNELS + 1):
+            return False
+        self._length = count - 1
+        self._universe = (buf[SACN_UNIVERSE] << 8) | buf[SACN_UNIVERSE + 1]
+        self._sequence = buf[SACN_SEQUENCE]
+        return True
+
+    # Validates the packet and stores its universe, sequence and channel count on the bridge.
+    # Returns False if the packet is invalid.
+    def _parse_artnet(self, size):
+        buf = self._buffer
+        if (size < ARTNET_DATA or not buf.startswith(ARTNET_ID)
+                or (buf[ARTNET_OPCODE] | (buf[ARTNET_OPCODE + 1] << 8)) != ARTNET_OP_DMX):
+            return False
+        length = (buf[ARTNET_LENGTH] << 8) | buf[ARTNET_LENGTH + 1]
+        if length > DMX_CHANNELS:
+            return False
+        self._length = min(length, size - ARTNET_DATA)
+        self._universe = buf[ARTNET_UNIVERSE] | (buf[ARTNET_UNIVERSE + 1] << 8)
+        self._sequence = buf[ARTNET_SEQUENCE]
+        return True
+
+    def take_frame(self, universe, out):
+        """Copy the latest frame for universe into out (a bytearray of at least 512 bytes).
+
+        Returns the number of valid channels, or 0 if nothing new arrived since the last call."""
+        frame = self.frames[universe]
+        with self.lock:
+            if not frame.fresh:
+                return 0
+            out[:DMX_CHANNELS] = frame.data
+            frame.fresh = False
+            return frame.length
+
+    def stats(self):
+        """Packet counters for logging / display."""
+        return {
+            'packets': self.packets,
+            'dropped': self.dropped,
+            'merged': sum(frame.merged for frame in self.frames.values()),
+            'universes': {
+                universe: {'received': frame.received, 'merged': frame.merged}
+                for universe, frame in self.frames.items()
+            },
+        }
+
+
+# Maps a DMX footprint onto the controller's cmd_parameters. Channels are relative to start_channel
+# (1 based, as on the desk):
+#   +0..+2  color1 R, G, B
+#   +3..+5  color2 R, G, B
+#   +6      brightness (0 = dimmest, 255 = full - see brightness_from_desk)
+#   +7      pattern select (see PATTERN_CHANNEL_COMMANDS - each command takes a band of values)
+#   +8..+9  interval, 16 bit coarse/fine, scaled onto 0 - LEDController.MAX_INTERVAL
+# The firmware has no per-pixel frame command, so the strip is driven through the pattern
+# commands and their parameters rather than pixel by pixel.
+PATTERN_CHANNEL_COMMANDS = ['SCA1', 'SCA2', 'SPR', 'SPT', 'SPW', 'SPS', 'SPF', 'Breathe', 'SLO']
+DMX_FOOTPRINT = 10
+
+# The firmware's brightness runs 1 (dimmest) to 255, with 0 meaning full brightness (see the
+# BRIGHTNESS note in LEDControllerSettings.ini). Shift the desk's 0 - 255 onto that so a fader
+# pulled to 0 gives the dimmest setting and 255 gives full.
+def brightness_from_desk(value):
+    return (value + 1) & 0xFF
+
+class DMXParameterMap(object):
+    # setBrightness is slow and shouldn't be sent often - a moving fader only sends the newest
+    # value at most this often.
+    BRIGHTNESS_HOLD_S = 1.0
+
+    def __init__(self, start_channel=1, max_interval=60000, clock=time.monotonic):
+        self.start = start_channel - 1
+        self.max_interval = max_interval
+        self.clock = clock
+        self.last = bytearray(DMX_FOOTPRINT)
+        self.first = True
+        self.brightness_pending = None
+        self.brightness_sent = None
+        self.brightness_sent_at = None
+
+    def apply(self, controller, data, length):
+        """Push any changed channels from data onto controller. Returns True if anything changed."""
+        start = self.start
+        if length < start + DMX_FOOTPRINT:
+            return False
+        if not self.first and data.find(self.last, start, start + DMX_FOOTPRINT) == start:
+            self.flush_brightness(controller) # desks resend unchanged frames, which lets a held value through
+            return False # nothing moved on the desk
+        self.last[:] = data[start:start + DMX_FOOTPRINT]
+        channels = self.last
+        band = 256 // len(PATTERN_CHANNEL_COMMANDS) + 1
+        cmd = PATTERN_CHANNEL_COMMANDS[channels[7] // band]
+        controller.set_command(
+            cmd,
+            color1=(channels[0] << 16) | (channels[1] << 8) | channels[2],
+            color2=(channels[3] << 16) | (channels[4] << 8) | channels[5],
+            interval=((channels[8] << 8) | channels[9]) * self.max_interval // 0xFFFF,
+        )
+        brightness = brightness_from_desk(channels[6])
+        # A fader that comes back to the value already sent cancels whatever was still held.
+        self.brightness_pending = brightness if brightness != self.brightness_sent else None
+        self.first = False
+        self.flush_brightness(controller)
+        return True
+
+    def flush_brightness(self, controller):
+        """Send the newest brightness from the desk, unless one was sent within BRIGHTNESS_HOLD_S."""
+        if self.brightness_pending is None:
+            return
+        now = self.clock()
+        if self.brightness_sent_at is not None and now - self.brightness_sent_at < self.BRIGHTNESS_HOLD_S:
+            return
+        controller.set_brightness(self.brightness_pending)
+        self.brightness_sent = self.brightness_pending
+        self.brightness_sent_at = now
+        self.brightness_pending = None
+
+
+# --- Local test sender ---
+
+def build_sacn_packet(universe, sequence, data, source_name=b'DMXBridge test'):
+    """Build an E1.31 data packet carrying data (up to 512 channels)."""
+    count = len(data) + 1
+    packet = bytearray()
+    packet += struct.pack('>HH12s', 0x0010, 0x0000, ACN_PACKET_ID)
+    packet += struct.pack('>HI16s', 0x7000 | (109 + count), 0x00000004, bytes(16))
+    packet += struct.pack('>HI64sBHBBH', 0x7000 | (87 + count), 0x00000002,
+        source_name.ljust(64, b'\x00'), 100, 0, sequence & 0xFF, 0, universe)
+    packet += struct.pack('>HBBHHHB', 0x7000 | (10 + count), 0x02, 0xA1, 0x0000, 0x0001, count, 0)
+    packet += bytes(data)
+    return bytes(packet)
+
+def build_artnet_packet(universe, sequence, data):
+    """Build an ArtDmx packet carrying data (up to 512 channels, padded to an even length)."""
+    data = bytes(data)
+    if len(data) % 2:
+        data += b'\x00'
+    return ARTNET_ID + struct.pack('<HBBBBH', ARTNET_OP_DMX, 0, 14, sequence & 0xFF, 0, universe) \
+        + struct.pack('>H', len(data)) + data
+
+
+def run_loopback_test(protocol='artnet', packets=20000):
+    """Blast packets at a local bridge as fast as possible and report what it kept."""
+    port = 16454 if protocol == 'artnet' else 15568
+    bridge = DMXBridge(protocol, universes=(1, 2), address='127.0.0.1', port=port)
+    bridge.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    out = bytearray(DMX_CHANNELS)
+    taken = 0
+    start = time.perf_counter()
+    for i in range(packets):
+        data = bytes([i & 0xFF]) * DMX_CHANNELS
+        if protocol == 'artnet':
+            packet = build_artnet_packet(1 + (i & 1), i, data)
+        else:
+            packet = build_sacn_packet(1 + (i & 1), i, data)
+        sender.sendto(packet, ('127.0.0.1', port))
+        if i % 500 == 0 and bridge.take_frame(1, out):
+            taken += 1 # simulate a slow consumer polling for frames
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)
+    bridge.stop()
+    sender.close()
+    stats = bridge.stats()
+    print("{0}: sent {1} packets in {2:.2f}s ({3:.0f} pkt/s), consumer took {4} frames."
+        .format(protocol, packets, elapsed, packets / elapsed, taken))
+    print("received {packets}, dropped {dropped}, merged {merged}, per universe {universes}".format(**stats))
+
+
+if __name__ == '__main__':
+    run_loopback_test('artnet')
+    run_loopback_test('sacn')
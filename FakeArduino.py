@@ -0,0 +1,234 @@
+#!python3
+# FakeArduino.py
+# A stand-in for the Arduino end of the serial link, for testing the controller without hardware.
+#
+# INSTRUCTIONS FOR USE: (in general....)
+# Pass a FakeArduino to LEDController.setupCmdMessenger() in place of a real port:
+#     device = FakeArduino(controller.commands, LEDs=60)
+#     controller.setupCmdMessenger(device)
+# The fake speaks the same CmdMessenger command table as the firmware (including the macro
+# extension), reports ARDUINOBUSY when each pattern finishes, confirms every command with CMDCONF,
+# and records what it was sent and what it showed. Time comes from clock() so tests can step it by
+# hand, and if baud_rate is given replies are held back for the time the bytes would take on the wire.
+
+import time # for delays, etc.
+
+import PyCmdMessenger # for encoding / decoding messages the same way the host does
+
+
+class _DeviceEnd(object):
+    """Board object for the fake's own CmdMessenger - reads what the host wrote, writes replies."""
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def __getattr__(self, name):
+        return getattr(self.fake, name) # board type sizes / limits
+
+    def read(self):
+        if not self.fake.to_device:
+            return b''
+        byte = bytes(self.fake.to_device[:1])
+        del self.fake.to_device[:1]
+        return byte
+
+    def write(self, msg):
+        self.fake.queue_reply(msg)
+
+
+class FakeSerial(object):
+    """The comm object the host polls, in place of serial.Serial."""
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    @property
+    def in_waiting(self):
+        self.fake.service()
+        return self.fake.available()
+
+    def read(self, size=1):
+        self.fake.service()
+        return self.fake.take(size)
+
+    def write(self, msg):
+        self.fake.receive(msg)
+        return len(msg)
+
+    def close(self):
+        pass
+
+
+class FakeArduino(PyCmdMessenger.ArduinoBoard):
+    """Emulates the LED firmware at the far end of a CmdMessenger link.
+
+    commands: the command table (LEDController.commands)
+    LEDs: number of LEDs on the fake strip, used for pattern timing
+    clock: returns the current time in seconds
+    """
+
+    MAX_MACROS = 8
+    MAX_MACRO_STEPS = 16
+
+    def __init__(self, commands, LEDs=60, clock=time.perf_counter, baud_rate=None, **kwargs):
+        self.commands = [name for name, _ in commands]
+        self.formats = dict(commands)
+        self.numLEDs = LEDs
+        self.clock = clock
+        self.to_device = bytearray()
+        self.to_host = [] # (time the bytes are readable, bytes)
+        self.rx_done = 0.0 # when the last message from the host finished arriving
+        PyCmdMessenger.ArduinoBoard.__init__(self, 'fake', baud_rate=baud_rate or 0, settle_time=0, **kwargs)
+        self.wire_baud = baud_rate
+        self.messenger = PyCmdMessenger.CmdMessenger(_DeviceEnd(self), commands)
+        # What the fake saw and did - for tests to check.
+        self.received = []   # (command, args) from the host
+        self.shown = []      # (command, args) actually displayed, from the host or from a macro
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.brightness = 0
+        self.macros = {}     # id -> {'steps': [(command, args)], 'loop': bool}
+        self.playing = None  # id of the macro being played
+        self.step = 0
+        self.step_ends = 0.0
+        self.ready_at = self.clock() # asks for its first command straight away
+
+    # --- ArduinoBoard ---
+
+    def open(self):
+        self.comm = FakeSerial(self)
+        self._is_connected = True
+
+    # --- Wire ---
+
+    def receive(self, msg):
+        self.bytes_received += len(msg)
+        self.rx_done = self.clock() + self.wire_time(msg)
+        self.to_device += msg
+        while self.to_device:
+            message = self.messenger.receive()
+            if message is None:
+                break
+            self.handle(message[0], message[1])
+
+    def queue_reply(self, msg):
+        self.bytes_sent += len(msg)
+        # A reply can't start until the message it answers has arrived.
+        start = max(self.clock(), self.rx_done)
+        self.to_host.append((start + self.wire_time(msg), bytearray(msg)))
+
+    # Seconds msg takes on the wire (10 bits per byte), if a baud rate is being simulated.
+    def wire_time(self, msg):
+        return len(msg) * 10.0 / self.wire_baud if self.wire_baud else 0.0
+
+    def available(self):
+        now = self.clock()
+        return sum(len(data) for at, data in self.to_host if at <= now)
+
+    def take(self, size):
+        # Like a serial port's read(), wait (up to the board timeout) for bytes still on the wire.
+        if self.wire_baud and self.to_host:
+            deadline = self.clock() + self.timeout
+            while self.to_host[0][0] > self.clock() and self.clock() < deadline:
+                time.sleep(0)
+        now = self.clock()
+        out = bytearray()
+        while self.to_host and self.to_host[0][0] <= now and len(out) < size:
+            data = self.to_host[0][1]
+            count = min(size - len(out), len(data))
+            out += data[:count]
+            del data[:count]
+            if not data:
+                self.to_host.pop(0)
+        return bytes(out)
+
+    # --- Firmware behaviour ---
+
+    def send(self, cmd, *args):
+        self.messenger.send(cmd, *args)
+
+    def confirm(self, cmd):
+        self.send("CMDCONF", self.commands.index(cmd))
+
+    def error(self, text):
+        self.send("CMDERROR", text)
+
+    # Called whenever the host looks at the port - asks for the next command once the current
+    # pattern has run, and steps through a playing macro.
+    def service(self):
+        now = self.clock()
+        while self.playing is not None and now >= self.step_ends:
+            macro = self.macros[self.playing]
+            self.step += 1
+            if self.step >= len(macro['steps']):
+                if not macro['loop']:
+                    self.playing = None
+                    self.ready_at = self.step_ends
+                    break
+                self.step = 0
+            self.show(*macro['steps'][self.step], start=self.step_ends)
+        if self.playing is None and self.ready_at is not None and now >= self.ready_at:
+            self.ready_at = None
+            self.send("ARDUINOBUSY", False)
+
+    def show(self, cmd, args, start=None):
+        self.shown.append((cmd, tuple(args)))
+        start = self.clock() if start is None else start
+        self.step_ends = start + self.duration_ms(cmd, args) / 1000.0
+        return self.step_ends
+
+    def duration_ms(self, cmd, args):
+        """How long the firmware runs a pattern before asking for the next command."""
+        if cmd == "SETPATTERNRAINBOW":
+            return args[0] * 256
+        if cmd in ("SETPATTERNTHEATER", "SETPATTERNWIPE"):
+            return args[-1] * self.numLEDs
+        if cmd == "SETPATTERNSCANNER":
+            return args[-1] * 2 * self.numLEDs
+        if cmd == "SETPATTERNFADE":
+            return args[2] * args[3]
+        if cmd in ("SETCOLORALL", "SETCOLORSINGLE", "SETCOLORRANGE", "SETLEDSOFF"):
+            return args[-1]
+        return 0
+
+    def handle(self, cmd, args):
+        self.received.append((cmd, tuple(args)))
+        # Any command ends macro playback - that's how the host takes the strip back.
+        self.playing = None
+        if cmd == "DEFINEMACRO":
+            macro_id, count, loop = args
+            if macro_id >= self.MAX_MACROS or not 0 < count <= self.MAX_MACRO_STEPS:
+                self.error("bad macro")
+                return
+            self.macros[macro_id] = {'steps': [None] * count, 'loop': loop}
+            self.confirm(cmd)
+        elif cmd == "MACROSTEP":
+            macro_id, index, cmd_id = args[:3]
+            macro = self.macros.get(macro_id)
+            if macro is None or index >= len(macro['steps']) or cmd_id >= len(self.commands):
+                self.error("bad macro step")
+                return
+            name = self.commands[cmd_id]
+            macro['steps'][index] = (name, tuple(args[3:3 + len(self.formats[name])]))
+            self.confirm(cmd)
+        elif cmd == "RUNMACRO":
+            macro = self.macros.get(args[0])
+            if macro is None or None in macro['steps']:
+                self.error("macro not defined")
+                return
+            self.confirm(cmd)
+            self.playing = args[0]
+            self.step = 0
+            self.show(*macro['steps'][0])
+        elif cmd == "SETBRIGHTNESSALL":
+            self.brightness = args[0]
+            self.confirm(cmd)
+            self.ready_at = self.clock()
+        elif cmd == "NOCOMMAND":
+            self.confirm(cmd)
+            self.ready_at = self.clock()
+        elif cmd in self.commands:
+            self.confirm(cmd)
+            self.ready_at = self.show(cmd, args)
+        else:
+            self.error("unknown command")
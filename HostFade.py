@@ -0,0 +1,136 @@
+#!python3
+# HostFade.py
+# High bit depth fades rendered on the host, with temporal dithering down to 8 bits per channel.
+#
+# INSTRUCTIONS FOR USE: (in general....)
+# The firmware's fade interpolates between two 8 bit colors in num-steps steps, which bands visibly at
+# low brightness (there are only a handful of 8 bit values between dim colors). Here the fade is kept in
+# floating point and every frame is quantized to 8 bits with the rounding error carried over into the
+# next frame, so over a few frames each LED averages out to the in-between value that 8 bits can't hold.
+#
+# Progress through the fade is taken from the wall clock rather than a frame count, so the fade keeps
+# its duration at whatever frame rate the serial link actually sustains.
+#
+# Run this file directly to benchmark the per-frame cost, and the frame rate a smooth fade reaches
+# end to end through the controller at common baud rates (against FakeArduino).
+
+import numbers # Telling single colors from per-LED arrays
+import time # for delays, etc.
+
+import numpy as np # Interpolation and dithering
+
+
+# Splits 0xRRGGBB colors into float R, G, B channels.
+def color_channels(color):
+    return np.array([(color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF], dtype=np.float64)
+
+
+class DitheredFade(object):
+    """Fades num_leds LEDs from color1 to color2 over duration_ms.
+
+    color1, color2: 0xRRGGBB ints, or arrays of shape (num_leds, 3) for per-LED endpoints
+    """
+
+    def __init__(self, color1, color2, duration_ms, num_leds=1):
+        self.num_leds = num_leds
+        self.duration = duration_ms / 1000.0
+        self.start_color = np.empty((num_leds, 3), dtype=np.float64)
+        self.start_color[:] = color_channels(int(color1)) if isinstance(color1, numbers.Integral) else color1
+        self.delta = np.empty((num_leds, 3), dtype=np.float64)
+        self.delta[:] = color_channels(int(color2)) if isinstance(color2, numbers.Integral) else color2
+        self.delta -= self.start_color
+        # Per frame work happens in these buffers, so rendering a frame does not allocate.
+        self.value = np.empty((num_leds, 3), dtype=np.float64)
+        self.error = np.zeros((num_leds, 3), dtype=np.float64)
+        self.quantized = np.empty((num_leds, 3), dtype=np.float64)
+        self.frame = np.empty((num_leds, 3), dtype=np.uint8)
+        self.started = None
+        self.frames = 0
+        # Temporal dithering only works if frames come fast enough for the eye to average them -
+        # below that it shows up as flicker between levels, so the caller turns it off.
+        self.dither = True
+
+    def start(self, now=None):
+        self.started = time.perf_counter() if now is None else now
+        self.frames = 0
+
+    def position(self, now=None):
+        """Fraction of the fade completed, 0 - 1."""
+        if self.started is None:
+            self.start(now)
+        if now is None:
+            now = time.perf_counter()
+        if self.duration <= 0:
+            return 1.0
+        return min(1.0, max(0.0, (now - self.started) / self.duration))
+
+    def done(self, now=None):
+        return self.position(now) >= 1.0
+
+    def render(self, now=None):
+        """Returns the 8 bit frame (uint8 array of shape (num_leds, 3)) for the current time.
+
+        The returned array is reused by the next call."""
+        position = self.position(now)
+        np.multiply(self.delta, position, out=self.value)
+        self.value += self.start_color
+        # Temporal dithering: add the error left over from the last frame, round, and keep the new
+        # error for the next frame.
+        if self.dither:
+            self.value += self.error
+        np.rint(self.value, out=self.quantized)
+        np.clip(self.quantized, 0, 255, out=self.quantized)
+        if self.dither:
+            np.subtract(self.value, self.quantized, out=self.error)
+        else:
+            self.error.fill(0.0)
+        self.frame[:] = self.quantized
+        self.frames += 1
+        return self.frame
+
+    def render_color(self, now=None):
+        """Render a frame for a single LED (or a uniformly colored strip) as a 0xRRGGBB int."""
+        r, g, b = self.render(now)[0]
+        return (int(r) << 16) | (int(g) << 8) | int(b)
+
+
+def run_benchmark(frames=2000):
+    """Print the per-frame render cost for a few strip lengths."""
+    for num_leds in (1, 60, 300, 1000):
+        fade = DitheredFade(0x080402, 0x000000, 1000, num_leds)
+        now = 0.0
+        fade.start(now)
+        start = time.perf_counter()
+        for i in range(frames):
+            fade.render(now + i / frames)
+        elapsed = time.perf_counter() - start
+        print("{0:5d} LEDs: {1:.1f} us/frame".format(num_leds, elapsed / frames * 1e6))
+    # Average output of a dim, held mid-fade value - should be close to the float value.
+    fade = DitheredFade(0x020202, 0x010101, 1000)
+    fade.start(0.0)
+    held = [fade.render(0.3)[0][0] for _ in range(1000)]
+    print("dithered average {0:.3f} for target 1.700".format(sum(int(v) for v in held) / len(held)))
+
+
+def run_link_benchmark(baud_rates=(9600, 57600, 115200), seconds=2.0):
+    """Run the controller's smooth fade against a FakeArduino at each baud rate and print the frame rate."""
+    import LEDController # imported here - the controller imports this module
+    from FakeArduino import FakeArduino
+    for baud in baud_rates:
+        controller = LEDController.LEDController(0, 'fake', baud, 60, 0)
+        device = FakeArduino(controller.commands, LEDs=60, baud_rate=baud)
+        controller.setupCmdMessenger(device)
+        controller.set_command('SFD', color1=0x101010, color2=0x000000, interval=1000)
+        frames = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            if controller.serial_has_waiting():
+                controller.repeat()
+                frames += 1
+        print("{0:6d} baud: {1:.0f} frames/s end to end, dithering {2}".format(
+            baud, frames / seconds, 'on' if controller.host_fade.dither else 'off'))
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    run_link_benchmark()
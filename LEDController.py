@@ -19,6 +19,10 @@ import logging # Program logging
 import configparser # Reading / writing configurations
 import time # for delays, etc.
 import base64 #for parsing hex color strings to numbers
+import struct # Sizing messages on the wire
+
+from DMXBridge import DMXBridge, DMXParameterMap # sACN / Art-Net input from a lighting desk
+from HostFade import DitheredFade # Host-side high bit depth fades
 
 # GUI things
 import tkinter as tk
@@ -29,12 +33,45 @@ from tkinter.colorchooser import *
 # LEDController needs to be global so that stop() can access it
 # at any time when the keyboard interrupt is triggered.
 LEDController = object
+# Optional lighting desk input - set up in setup() when DMXEnabled is set in the settings file.
+dmx_bridge = None
+dmx_map = None
+dmx_universe = 1
+dmx_buffer = bytearray(512)
+# The bridge's packet counters are written to the log this often while it runs.
+DMX_STATS_INTERVAL_S = 60
+dmx_stats_due = 0.0
 
 class LEDController(object):
     MAX_INTERVAL = 60000
     MIN_INTERVAL = 0
-
-    def __init__(self, timeout, port, baudrate, LEDs, brightness):
+    # Device-resident macros (firmware protocol extension) - limits match the firmware's tables.
+    MAX_MACROS = 8
+    MAX_MACRO_STEPS = 16
+    MACRO_ARGS = 4
+    BREATHE_MACRO = 0
+    # Primitives the device can replay from a macro - everything else is host-side bookkeeping.
+    MACRO_PRIMITIVES = ("SETCOLORALL", "SETCOLORSINGLE", "SETCOLORRANGE", "SETPATTERNRAINBOW",
+        "SETPATTERNTHEATER", "SETPATTERNWIPE", "SETPATTERNSCANNER", "SETPATTERNFADE", "SETLEDSOFF")
+    # Replies are waited on by spinning for this long before falling back to 100ms sleeps -
+    # confirmations arrive within a few ms and a sleep would swamp any timing of them.
+    REPLY_SPIN_S = 0.05
+    # Smooth fade frames are held for as short a time as possible so the frame rate is set by
+    # how fast the link can turn commands around.
+    HOST_FADE_HOLD_MS = 1
+    # Below this frame rate temporal dithering flickers visibly instead of smoothing, so the smooth
+    # fade falls back to plain rounding.
+    MIN_DITHER_FPS = 50
+    # How often update_controller checks on the device - as often as possible during the smooth fade,
+    # since every frame costs a round trip.
+    POLL_MS = 75
+    HOST_FADE_POLL_MS = 1
+    # How PyCmdMessenger packs each argument type for an ATmega board, used to size messages.
+    ARG_PACKING = {'b': '<B', '?': '<?', 'i': '<h', 'I': '<H', 'l': '<i', 'L': '<I', 'f': '<f', 'd': '<f'}
+    # CmdMessenger escapes these bytes inside arguments, which costs an extra byte each.
+    ESCAPED_BYTES = b',;/\0'
+
+    def __init__(self, timeout, port, baudrate, LEDs, brightness, macros=False):
         self.timeout = timeout
         self.port = port
         self.baudrate = baudrate
@@ -42,6 +79,7 @@ class LEDController(object):
         self.brightness = brightness
         self.c = None
         self.cmdMessenger = None
+        self.reply_time = None # perf_counter() when the last reply started arriving
         self.commands = [["CMDERROR", "s"],
                          ["SETCOLORALL", "LL"],
                          ["SETCOLORSINGLE", "bLL"],
@@ -55,7 +93,19 @@ class LEDController(object):
                          ["SETLEDSOFF", "L"],
                          ["ARDUINOBUSY", "?"],
                          ["NOCOMMAND", "?"],
-                         ["CMDCONF", "L"]]
+                         ["CMDCONF", "L"],
+                         ["DEFINEMACRO", "bb?"],
+                         ["MACROSTEP", "bbbLLLL"],
+                         ["RUNMACRO", "b"]]
+        # Macros are only used when the firmware has been built with the macro extension.
+        self.macros_enabled = macros
+        self.macros = {}
+        self.macro_recording = None
+        self.macro_running = None
+        self.host_fade = None
+        self.host_fade_state = None
+        self.host_fade_last = None # time of the last smooth fade frame
+        self.host_fade_fps = None  # smoothed frame rate the link is achieving
         self.last_command_lambda = 'Breathe'
         # last cycle is used as a switch to alternate animations that use
         # other commands as primitives (see Breathe effect)
@@ -108,7 +158,8 @@ class LEDController(object):
             ),
             'SBA': lambda: self.setBrightness(self.cmd_parameters['brightness']),
             'SLO': lambda: self.setLedsOff(self.cmd_parameters['interval']),
-            'Breathe': lambda: self.breathe_effect()
+            'Breathe': lambda: self.breathe_effect(),
+            'SFD': lambda: self.smooth_fade_effect()
         }
         # Initial settings for commands - these get changed throughout the 
         # lifecycle of the program.
@@ -123,9 +174,13 @@ class LEDController(object):
 
     # Set up the PyCmdMessenger library (which also handles setup of the
     # serial port given and allows structured communication over serial.)
-    def setupCmdMessenger(self):
-        """Initialize the command messenger"""
-        self.cmdMessenger = PyCmdMessenger.ArduinoBoard(self.port, baud_rate=self.baudrate)
+    def setupCmdMessenger(self, board=None):
+        """Initialize the command messenger
+
+        board: talk through this instead of opening self.port (eg. a FakeArduino)"""
+        if board is None:
+            board = PyCmdMessenger.ArduinoBoard(self.port, baud_rate=self.baudrate)
+        self.cmdMessenger = board
         self.c = PyCmdMessenger.CmdMessenger(self.cmdMessenger, self.commands)
 
     # A faster way of checking the serial line for incoming data - use to prevent
@@ -141,8 +196,13 @@ class LEDController(object):
     def getCommandSet(self, src):
         received_cmd_set = None
         logging.debug(src + ': getCommand...')
+        waiting_since = time.perf_counter()
         while (self.cmdMessenger.comm.in_waiting == 0): # blocking - here as a final check before self.c.receive()
-            time.sleep(0.1)
+            if time.perf_counter() - waiting_since < self.REPLY_SPIN_S:
+                time.sleep(0) # let other threads run, but don't give up the timing
+            else:
+                time.sleep(0.1)
+        self.reply_time = time.perf_counter()
         received_cmd_set = self.c.receive()
         logging.debug(src + ': getCommand complete.')
         if (received_cmd_set[0] == "CMDERROR"):
@@ -161,20 +221,28 @@ class LEDController(object):
         else:
             return False
 
+    # Sends a command and waits for the device to confirm it. Returns the device's reply. While a
+    # macro is being recorded (see compileMacro) the command is only stored as a macro step, nothing
+    # is sent and None is returned.
+    def transmit(self, cmd, *args, trace=''):
+        if self.macro_recording is not None:
+            self.macro_recording.append((cmd, args))
+            return None
+        self.c.send(cmd, *args)
+        return self.getCommandSet(trace)
+
     # --- Command definitions --- Add additional commands below here, integrate command lambdas above.
         
     # Sets all of the LEDs in the strip to the color desired, and for a duration equal to update_ms.
     def setColorAll(self, color, update_ms):
         color = self.constrainColor(color)
-        self.c.send("SETCOLORALL", color, update_ms)
-        self.getCommandSet('SCA return')
+        self.transmit("SETCOLORALL", color, update_ms, trace='SCA return')
 
     # Sets a single LED (index) to the color desired, and for a duration equal to update_ms.
     def setColorSingle(self, color, index, update_ms):
         color = self.constrainColor(color)
         index = self.constrain(index, 0, self.numLEDs)
-        self.c.send("SETCOLORSINGLE", index, color, update_ms)
-        self.getCommandSet('SCS return')
+        self.transmit("SETCOLORSINGLE", index, color, update_ms, trace='SCS return')
 
     # Sets a number of LEDs, starting at st_led (index), to a desired color.
     # update_ms doesn't have much functionality here, as the update is instantaneous and there
@@ -183,62 +251,204 @@ class LEDController(object):
         color = self.constrainColor(color)
         st_led = self.constrain(st_led, 0, self.numLEDs-1)
         num = self.constrain(num, 0, self.numLEDs-st_led)
-        self.c.send("SETCOLORRANGE", st_led, num, color, update_ms)
-        self.getCommandSet('SCR return')
+        self.transmit("SETCOLORRANGE", st_led, num, color, update_ms, trace='SCR return')
 
     # Sets the controller to activate the rainbow pattern.
     # Use update_ms to control how fast the pattern updates.
     def setPatternRainbow(self, update_ms):
-        self.c.send("SETPATTERNRAINBOW", max(1, int(update_ms/256)))
-        self.getCommandSet('SPR return')
+        self.transmit("SETPATTERNRAINBOW", max(1, int(update_ms/256)), trace='SPR return')
 
     # Sets the controller to activate a theater chase pattern, consisting of alternating
     # color1 and color2. Update_ms defines how fast the pattern will update.
     def setPatternTheater(self, color1, color2, update_ms):
         color1 = self.constrainColor(color1)
         color2 = self.constrainColor(color2)
-        self.c.send("SETPATTERNTHEATER", color1, color2, max(1, int(update_ms/self.numLEDs)))
-        self.getCommandSet('SPT return')
+        self.transmit("SETPATTERNTHEATER", color1, color2, max(1, int(update_ms/self.numLEDs)), trace='SPT return')
 
     # Wipe pattern sets each led in sequence to color given over over the time period.
     def setPatternWipe(self, color, update_ms):
         color = self.constrainColor(color)
-        self.c.send("SETPATTERNWIPE", color, max(1, int(update_ms/self.numLEDs)))
-        self.getCommandSet('SPW return')
+        self.transmit("SETPATTERNWIPE", color, max(1, int(update_ms/self.numLEDs)), trace='SPW return')
 
     # Sets LEDs in sequence to give a bright point traveling along the string and back again.
     def setPatternScanner(self, color, update_ms):
         color = self.constrainColor(color)
-        self.c.send("SETPATTERNSCANNER", color, max(1, int(update_ms/(2*self.numLEDs))))
-        self.getCommandSet('SPS return')
+        self.transmit("SETPATTERNSCANNER", color, max(1, int(update_ms/(2*self.numLEDs))), trace='SPS return')
 
     # Starts at color 1 and then fades to color 2 - a component of the breathe effect (transitions
     # between color 1 and 2 and then returns to color 1 again)
     def setPatternFade(self, color1, color2, steps, update_ms):
         color1 = self.constrainColor(color1)
         color2 = self.constrainColor(color2)
-        self.c.send("SETPATTERNFADE", color1, color2, steps, max(1, int(update_ms/steps)))
-        self.getCommandSet('SPF return')
+        self.transmit("SETPATTERNFADE", color1, color2, steps, max(1, int(update_ms/steps)), trace='SPF return')
 
     # Sets the global brightness parameter on the LED controller (Arduino or similar) which will
     # handle scaling brightness of given color parameters. 
     # Slow - Should not be used often or for patterning.
     def setBrightness(self, brightness):
         brightness = self.constrain(brightness, 0, 255)
-        self.c.send("SETBRIGHTNESSALL", brightness)
+        self.transmit("SETBRIGHTNESSALL", brightness, trace='Brightness return')
         self.brightness_set_cycle = False # return controller to normal operations once complete
         self.set_command_brightness()
-        self.getCommandSet('Brightness return')
 
     # Turns off LEDs
     def setLedsOff(self, update_ms):
-        self.c.send("SETLEDSOFF", update_ms)
-        self.getCommandSet('SLO return')
+        self.transmit("SETLEDSOFF", update_ms, trace='SLO return')
 
     # Use to send no command at interval - controller will continue last command.
     def setNoCmd(self, flag=True):
-        self.c.send("NOCOMMAND", flag)
-        self.getCommandSet('SNC return')
+        self.transmit("NOCOMMAND", flag, trace='SNC return')
+
+    # --- Macro definitions --- Protocol extension: a sequence of primitives is uploaded to the
+    # device once and then played back there, so the serial link is idle during playback instead
+    # of carrying a poll / command / confirmation round trip for every step.
+
+    def compileMacro(self, *steps):
+        """Compile primitives into macro steps without sending anything.
+
+        steps: callables that each call one primitive, eg. lambda: self.setPatternWipe(0xFF0000, 500)
+        Returns a list of (command, args) with the same arguments the primitive would have sent.
+        Only MACRO_PRIMITIVES can be recorded. Steps that send anything else (eg. setBrightness) or
+        that change the controller's own state can't be replayed by the device - they are undone
+        and rejected with a ValueError."""
+        state = self.controller_state()
+        self.macro_recording = []
+        try:
+            for step in steps:
+                step()
+            compiled = self.macro_recording
+        finally:
+            self.macro_recording = None
+            changed = self.controller_state() != state
+            if changed:
+                self.restore_controller_state(state)
+        if changed:
+            raise ValueError('Macro steps must only send primitives - a step changed the controller state')
+        for cmd, _ in compiled:
+            if cmd not in self.MACRO_PRIMITIVES:
+                raise ValueError('{0} can not be used in a macro'.format(cmd))
+        if not 0 < len(compiled) <= self.MAX_MACRO_STEPS:
+            raise ValueError('Macro must have 1 to {0} steps, got {1}'.format(self.MAX_MACRO_STEPS, len(compiled)))
+        return compiled
+
+    # State that primitives must not touch while being recorded into a macro.
+    def controller_state(self):
+        return (self.command_state(), self.brightness_set_cycle, self.brightness_set_last_cmd,
+            self.last_cycle, self.host_fade, self.host_fade_state)
+
+    def restore_controller_state(self, state):
+        (last_command_lambda, parameters), self.brightness_set_cycle, self.brightness_set_last_cmd, \
+            self.last_cycle, self.host_fade, self.host_fade_state = state
+        self.last_command_lambda = last_command_lambda
+        self.cmd_parameters = dict(parameters)
+
+    # Arguments of the MACROSTEP message for one compiled step.
+    def macro_step_args(self, macro_id, index, cmd, args):
+        args = [int(arg) for arg in args] + [0] * (self.MACRO_ARGS - len(args))
+        return [macro_id, index, self.command_id(cmd)] + args
+
+    def uploadMacro(self, macro_id, compiled, loop=True):
+        """Store a compiled macro on the device under macro_id. Call when the device is ready.
+
+        Returns True if the device confirmed every message. On a CMDERROR (or anything else) the
+        upload stops and False is returned - the device is then waiting for a command."""
+        macro_id = self.constrain(macro_id, 0, self.MAX_MACROS-1)
+        self.macros.pop(macro_id, None)
+        reply = self.transmit("DEFINEMACRO", macro_id, len(compiled), loop, trace='DMA return')
+        if not self.confirmed(reply):
+            logging.error("Macro {0} upload rejected: {1}".format(macro_id, reply))
+            return False
+        for index, (cmd, args) in enumerate(compiled):
+            reply = self.transmit("MACROSTEP", *self.macro_step_args(macro_id, index, cmd, args), trace='MST return')
+            if not self.confirmed(reply):
+                logging.error("Macro {0} step {1} upload rejected: {2}".format(macro_id, index, reply))
+                return False
+        self.macros[macro_id] = compiled
+        return True
+
+    def runMacro(self, macro_id):
+        """Start playback of an uploaded macro. The device stops asking for commands until a new
+        command is sent to it, which also ends playback.
+
+        Returns True if the device confirmed. If not, nothing is playing and the device is waiting
+        for a command."""
+        reply = self.transmit("RUNMACRO", macro_id, trace='RMA return')
+        if not self.confirmed(reply):
+            logging.error("Macro {0} run rejected: {1}".format(macro_id, reply))
+            self.macros.pop(macro_id, None)
+            return False
+        self.macro_running = self.command_state()
+        traffic = self.macro_traffic(macro_id, self.macros[macro_id])
+        logging.info("Macro {0} of {1} steps: per-step playback would send {2} bytes / pass ({3:.1f} bytes/s), "
+            "device playback sends 0 bytes/s after a one-off {4} byte upload."
+            .format(macro_id, len(self.macros[macro_id]), traffic['per_step_bytes'],
+                traffic['per_step_bytes_per_s'], traffic['upload_bytes']))
+        return True
+
+    # True if reply (from transmit) is the device's confirmation of the command.
+    def confirmed(self, reply):
+        return reply is not None and reply[0] == "CMDCONF"
+
+    def macro_interrupted(self):
+        """Return true if a macro is playing but the UI has since asked for something else."""
+        return self.macro_running is not None and self.macro_running != self.command_state()
+
+    def interrupt_macro(self):
+        """Send the current command straight away - the device is not polling during playback."""
+        self.macro_running = None
+        self.cmd_lambdas[self.last_command_lambda]()
+
+    def command_state(self):
+        return (self.last_command_lambda, tuple(sorted(self.cmd_parameters.items())))
+
+    def command_id(self, cmd):
+        return [name for name, _ in self.commands].index(cmd)
+
+    def message_bytes(self, cmd, *args):
+        """Size on the wire of one CmdMessenger message for cmd with args, separators and escapes included."""
+        formats = dict(self.commands)[cmd]
+        size = len(str(self.command_id(cmd))) + 1 # command id and terminator
+        for arg_format, arg in zip(formats, args):
+            packed = struct.pack(self.ARG_PACKING[arg_format], arg)
+            size += 1 + len(packed) + sum(packed.count(byte) for byte in self.ESCAPED_BYTES)
+        return size
+
+    # Device -> host bytes for one command: the ready poll that asked for it is counted separately,
+    # and the confirmation carries the id of the command confirmed.
+    def confirm_bytes(self, cmd):
+        return self.message_bytes("CMDCONF", self.command_id(cmd))
+
+    def step_ms(self, cmd, args):
+        """How long the device runs a primitive before it moves on - mirrors the firmware."""
+        if cmd == "SETPATTERNRAINBOW":
+            return args[0] * 256
+        if cmd in ("SETPATTERNTHEATER", "SETPATTERNWIPE"):
+            return args[-1] * self.numLEDs
+        if cmd == "SETPATTERNSCANNER":
+            return args[-1] * 2 * self.numLEDs
+        if cmd == "SETPATTERNFADE":
+            return args[2] * args[3]
+        return args[-1] if args else 0
+
+    def macro_traffic(self, macro_id, compiled):
+        """Serial traffic for one pass of a macro played per step vs. a one-off upload and run.
+
+        Returns a dict of per_step_bytes, per_step_bytes_per_s, upload_bytes and pass_s."""
+        poll = self.message_bytes("ARDUINOBUSY", False)
+        per_step = sum(poll + self.message_bytes(cmd, *args) + self.confirm_bytes(cmd) for cmd, args in compiled)
+        upload = poll + self.message_bytes("DEFINEMACRO", macro_id, len(compiled), True) \
+            + self.confirm_bytes("DEFINEMACRO") \
+            + self.message_bytes("RUNMACRO", macro_id) + self.confirm_bytes("RUNMACRO")
+        for index, (cmd, args) in enumerate(compiled):
+            upload += self.message_bytes("MACROSTEP", *self.macro_step_args(macro_id, index, cmd, args)) \
+                + self.confirm_bytes("MACROSTEP")
+        pass_s = sum(self.step_ms(cmd, args) for cmd, args in compiled) / 1000.0
+        return {
+            'per_step_bytes': per_step,
+            'per_step_bytes_per_s': per_step / pass_s if pass_s else 0.0,
+            'upload_bytes': upload,
+            'pass_s': pass_s,
+        }
 
     # --- Composite Effect definitions --- Use some of the primitives above in combination
     # to create more advanced effects.
@@ -246,6 +456,13 @@ class LEDController(object):
     # Alternates two colors on a fade effect to give a 'breathing' animation.
     # Uses the same parameters as fade.
     def breathe_effect(self):
+        if self.macros_enabled:
+            if self.breathe_macro():
+                return
+            # The device rejected the macro (eg. firmware without the macro extension) and is
+            # waiting for a command - send this step the old way, and stay on per-step from now.
+            logging.warning("Macros rejected by the device - Breathe falls back to per-step playback.")
+            self.macros_enabled = False
         self.last_cycle = self.constrain(self.last_cycle, 0, 1) # ensure we start correctly
         if self.last_cycle == 0:
             self.setPatternFade(
@@ -264,6 +481,62 @@ class LEDController(object):
             )
             self.last_cycle -= 1
 
+    # Breathe as a looping device-resident macro - both fades are uploaded once (and again only
+    # when the colors or timing change) and the link stays idle while the device plays them.
+    # Returns False if the device rejected the upload or the run.
+    def breathe_macro(self):
+        compiled = self.compileMacro(
+            lambda: self.setPatternFade(
+                self.cmd_parameters['color1'],
+                self.cmd_parameters['color2'],
+                self.cmd_parameters['num-steps'],
+                self.cmd_parameters['interval']
+            ),
+            lambda: self.setPatternFade(
+                self.cmd_parameters['color2'],
+                self.cmd_parameters['color1'],
+                self.cmd_parameters['num-steps'],
+                self.cmd_parameters['interval']
+            )
+        )
+        if self.macros.get(self.BREATHE_MACRO) != compiled:
+            if not self.uploadMacro(self.BREATHE_MACRO, compiled):
+                return False
+        return self.runMacro(self.BREATHE_MACRO)
+
+    # Breathe rendered on the host instead of by the firmware's fade: each repeat sends one frame
+    # of a float precision, temporally dithered fade with setColorAll, so low brightness fades
+    # don't band and no serial bandwidth is spent on raising num-steps.
+    def smooth_fade_effect(self):
+        now = time.perf_counter()
+        if self.host_fade_last is not None and now - self.host_fade_last < 1.0: # not a restart
+            fps = 1.0 / max(now - self.host_fade_last, 1e-6)
+            self.host_fade_fps = fps if self.host_fade_fps is None else 0.9 * self.host_fade_fps + 0.1 * fps
+        self.host_fade_last = now
+        state = (self.cmd_parameters['color1'], self.cmd_parameters['color2'], self.cmd_parameters['interval'])
+        if self.host_fade is None or self.host_fade_state != state:
+            self.host_fade = DitheredFade(state[0], state[1], state[2])
+            self.host_fade_state = state
+            self.last_cycle = 0
+        elif self.host_fade.duration > 0 and self.host_fade.done(now):
+            # (A zero interval has no fade to run back - it holds color2 rather than flipping
+            # between the two colors on every frame.)
+            logging.debug("smooth fade: {0} frames in {1} ms, {2:.1f} fps, dithering {3}".format(
+                self.host_fade.frames, state[2], self.host_fade_fps or 0.0, 'on' if self.host_fade.dither else 'off'))
+            self.last_cycle = 1 - self.last_cycle
+            error = self.host_fade.error
+            if self.last_cycle == 0:
+                self.host_fade = DitheredFade(state[0], state[1], state[2])
+            else:
+                self.host_fade = DitheredFade(state[1], state[0], state[2])
+            self.host_fade.error[:] = error # keep dithering continuous across the turn around
+        self.host_fade.dither = self.host_fade_fps is not None and self.host_fade_fps >= self.MIN_DITHER_FPS
+        self.setColorAll(self.host_fade.render_color(now), self.HOST_FADE_HOLD_MS)
+
+    def poll_interval(self):
+        """Milliseconds until update_controller should next check on the device."""
+        return self.HOST_FADE_POLL_MS if self.last_command_lambda == 'SFD' else self.POLL_MS
+
     # --- Utility definitions ---
     
     # Description
@@ -373,7 +646,7 @@ class MainUIPage(ttk.Frame):
         button_container = ttk.Frame(self)
         button_container.grid()
         # counters to keep track of element locations on control grid
-        row_counter = 7 #max
+        row_counter = 8 #max
         column_counter = 3 #max
         button_container.grid_rowconfigure(row_counter, weight=1)
         button_container.grid_columnconfigure(column_counter, weight=1)
@@ -566,6 +839,16 @@ class MainUIPage(ttk.Frame):
         )
         set_brightness_button.grid(row=row_counter, column=column_counter)
 
+        # ROW 8
+        column_counter = 0
+        row_counter += 1
+        smooth_fade_pattern_button = ttk.Button(
+            button_container,
+            text="Smooth Fade",
+            command=lambda: LEDController.set_command('SFD')
+        )
+        smooth_fade_pattern_button.grid(row=row_counter, column=column_counter)
+
 
     def validate_interval_entry(self, P, s, S):
         """Only allows ints"""
@@ -594,7 +877,7 @@ class MainUIPage(ttk.Frame):
 
 # Read configuration file and set up attributes
 def setup():
-    global LEDController
+    global LEDController, dmx_bridge, dmx_map, dmx_universe
     config = configparser.ConfigParser()
     try:
         config.read_file(open("LEDControllerSettings.ini"))
@@ -604,8 +887,9 @@ def setup():
         log_level = config.get('LEDControllerSettings', 'LogLevel')
         LEDs = config.getint('LEDControllerSettings', 'LEDs')
         brightness = config.getint('LEDControllerSettings', 'Brightness')
+        macros = config.getboolean('LEDControllerSettings', 'Macros')
 
-        LEDController = LEDController(timeout, port, baudrate, LEDs, brightness)
+        LEDController = LEDController(timeout, port, baudrate, LEDs, brightness, macros)
         LEDController.setupCmdMessenger()
 
         numeric_level = getattr(logging, log_level.upper(), None)
@@ -618,6 +902,18 @@ def setup():
         logging.info("Program Started with Serial Port: {0}, Timeout: {1}, Baudrate: {2}, Log Level: {3}. Num LEDs set to {4}."\
             .format(LEDController.port, timeout, baudrate, log_level, LEDs))
 
+        if config.getboolean('LEDControllerSettings', 'DMXEnabled'):
+            dmx_universe = config.getint('LEDControllerSettings', 'DMXUniverse')
+            dmx_bridge = DMXBridge(
+                config.get('LEDControllerSettings', 'DMXProtocol'),
+                universes=(dmx_universe,)
+            )
+            dmx_map = DMXParameterMap(
+                config.getint('LEDControllerSettings', 'DMXStartChannel'),
+                LEDController.MAX_INTERVAL
+            )
+            dmx_bridge.start()
+
     except FileNotFoundError as e:
         setup_log(logging.DEBUG)
         logging.critical("Unable to open \'LEDControllerSettings.ini\'. Error Text: {!r}".format(e))
@@ -645,9 +941,23 @@ def pre_run_commands():
 # the UI/Controller code and the actual controller.
 def update_controller():
     """Check the LED Controller, and issue, or re-issue a command as needed"""
-    if LEDController.serial_has_waiting():
+    global dmx_stats_due
+    waiting = LEDController.serial_has_waiting()
+    # Only the newest desk frame is applied, and only when the Arduino is ready for its next
+    # command (or is playing a macro, which a desk change needs to interrupt) - anything the
+    # desk sent in between is merged away by the bridge.
+    if dmx_bridge is not None and (waiting or LEDController.macro_running is not None):
+        length = dmx_bridge.take_frame(dmx_universe, dmx_buffer)
+        if length:
+            dmx_map.apply(LEDController, dmx_buffer, length)
+    if dmx_bridge is not None and time.monotonic() >= dmx_stats_due:
+        logging.info("DMXBridge: {0}".format(dmx_bridge.stats()))
+        dmx_stats_due = time.monotonic() + DMX_STATS_INTERVAL_S
+    if LEDController.macro_interrupted():
+        LEDController.interrupt_macro()
+    elif waiting:
         LEDController.repeat()
-    app.after(75, update_controller)
+    app.after(LEDController.poll_interval(), update_controller)
 
 
 # Demo code that will go through all the possible command combinations that
@@ -737,8 +1047,11 @@ def run_demo():
         time.sleep(.01)
 
 def end_program(end_condition):
-    global LEDController
+    global LEDController, dmx_bridge
     # LEDController.ser.close()
+    if dmx_bridge is not None:
+        dmx_bridge.stop() # logs the final packet counters
+        dmx_bridge = None
     print("Complete. {}".format(end_condition))
     logging.info("Program End.")
 
@@ -749,14 +1062,17 @@ def stop():
     end_program("")
 
 # This needs to be available in the global scope so that update_controller() and main
-# can both find it easily.
-app = ControllerUI()
+# can both find it easily. It is created under __main__ so that the controller can be imported
+# (eg. by the tests) without opening a window.
+app = None
 
 if __name__ == '__main__':
+    app = ControllerUI()
     try:
         if setup():
             pre_run_commands()
             app.after(500, update_controller)
             app.mainloop()
+            end_program("Window closed.")
     except KeyboardInterrupt: # Called when user ends process with CTRL+C
         stop()
@@ -0,0 +1,223 @@
+#!python3
+# LEDSync.py
+# Synchronized playback across several LED controllers (one Arduino per serial port).
+#
+# INSTRUCTIONS FOR USE: (in general....)
+# Build one LEDController per serial port (and call setupCmdMessenger() on each), hand them to a
+# SyncGroup, call measure_latency() once the Arduinos are talking, then start each show through
+# show(). Every device is held until all of them have asked for their next command (or
+# ready_timeout_s runs out, and the show goes ahead on those that have), and the sends
+# are then staggered by each link's measured one-way latency so the command lands on every strip at
+# the same moment, rather than whenever each device's own round trip happens to finish.
+#
+# Latency is measured on the existing exchange: wait for the device to report ARDUINOBUSY (ready),
+# send NOCOMMAND (the device keeps running its current pattern) and time the first byte of the
+# confirmation. Half the fastest round trip seen is taken as the link's one-way latency.
+
+import logging # Program logging
+import threading # One thread per device so the serial links are serviced in parallel
+import time # for delays, etc.
+
+
+class SyncGroup(object):
+    """Schedules commands on several LED controllers so they take effect together.
+
+    controllers: LEDController objects, already set up with setupCmdMessenger()
+    target_skew_ms: skew that a show is expected to stay within - shows over this are logged
+    margin_ms: scheduling headroom added on top of the slowest link
+    ready_timeout_s: how long a show (or a latency ping) waits for a device to ask for a command -
+        the show goes ahead on the devices that did. A device whose thread is still blocked on its
+        serial link is left out of later shows and pings until that thread finishes, so two threads
+        never read the same port.
+    """
+
+    # Sleep until this close to a send time, then spin - time.sleep() alone is far too coarse
+    # (15 ms on Windows) for a few millisecond target.
+    SPIN_S = 0.002
+
+    def __init__(self, controllers, target_skew_ms=5.0, margin_ms=20.0, ready_timeout_s=30.0):
+        self.controllers = list(controllers)
+        self.target_skew_ms = target_skew_ms
+        self.margin_ms = margin_ms
+        self.ready_timeout_s = ready_timeout_s
+        self.latency = [0.0] * len(self.controllers) # one-way, seconds
+        self.reports = []
+        self.busy = {} # index -> thread still blocked on that controller's serial link
+        self._target = 0.0
+
+    def measure_latency(self, samples=8):
+        """Ping every available device samples times and store its one-way latency estimate.
+
+        The round trip runs from just before NOCOMMAND is written to the first byte of the reply
+        (LEDController.reply_time). Returns the latency per device in milliseconds - devices that
+        didn't answer in time keep their previous estimate."""
+        def ping(index, controller):
+            best = None
+            for _ in range(samples):
+                try:
+                    if not controller.arduino_ready('sync ping'):
+                        continue
+                    start = time.perf_counter()
+                    controller.setNoCmd()
+                except Exception as e:
+                    logging.error("LEDSync: ping to {0} failed: {1!r}".format(controller.port, e))
+                    break
+                rtt = controller.reply_time - start
+                best = rtt if best is None else min(best, rtt)
+            if best is None:
+                logging.warning("LEDSync: no ping replies from {0}.".format(controller.port))
+            else:
+                self.latency[index] = best / 2
+        stuck = self._join(self._start_all(ping, self.available()), self.ready_timeout_s + 1.0)
+        if stuck:
+            logging.error("LEDSync: latency ping timed out on {0}.".format(self._ports(stuck)))
+        result = {controller.port: self.latency[i] * 1000.0 for i, controller in enumerate(self.controllers)}
+        logging.info("LEDSync: one-way latency (ms) {0}".format(result))
+        return result
+
+    def show(self, name, command):
+        """Start a show on every ready device at once.
+
+        command: callable taking an LEDController, eg. lambda c: c.setPatternWipe(0xFF0000, 2000)
+        Returns the show report (also kept in self.reports). The skew is worked out from when each
+        device confirmed the command, less that link's latency - an estimate of when each device
+        actually acted on it. send_jitter_ms only shows how closely the sends kept to schedule."""
+        count = len(self.controllers)
+        indices = self.available()
+        ready = [False] * count
+        asked = [False] * count # finished waiting for ready, one way or another
+        sent = [None] * count
+        acted = [None] * count
+        released = set()
+        answered = threading.Condition()
+        go = threading.Event()
+
+        def run(index, controller):
+            try:
+                ready[index] = controller.arduino_ready('sync ' + name)
+            except Exception as e:
+                logging.error("LEDSync: {0} failed waiting for ready: {1!r}".format(controller.port, e))
+            with answered:
+                asked[index] = True
+                answered.notify()
+            go.wait()
+            if index not in released:
+                if ready[index]:
+                    # Ready too late for the show - it is waiting for a command now, so give it
+                    # the show's command anyway rather than leave the strip stalled.
+                    logging.warning("LEDSync: {0} was late for show {1}.".format(controller.port, name))
+                    try:
+                        command(controller)
+                    except Exception as e:
+                        logging.error("LEDSync: show {0} failed on {1}: {2!r}".format(name, controller.port, e))
+                return
+            send_at = self._target - self.latency[index]
+            self._wait_until(send_at)
+            sent[index] = time.perf_counter()
+            try:
+                command(controller)
+            except Exception as e:
+                logging.error("LEDSync: show {0} failed on {1}: {2!r}".format(name, controller.port, e))
+                return
+            acted[index] = controller.reply_time - self.latency[index]
+
+        # Wait for every device to ask for a command (or the timeout), then release only those that
+        # did, with a start time far enough out that the slowest of their links can still make it.
+        threads = self._start_all(run, indices)
+        with answered:
+            answered.wait_for(lambda: all(asked[i] for i, _ in threads), self.ready_timeout_s)
+            released.update(i for i, _ in threads if ready[i])
+            waiting = [(i, thread) for i, thread in threads if not asked[i]]
+        latencies = [self.latency[i] for i in released]
+        self._target = time.perf_counter() + max(latencies, default=0.0) + self.margin_ms / 1000.0
+        go.set()
+        for i, thread in waiting:
+            self.busy[i] = thread # still blocked waiting for ready
+        self._join([(i, thread) for i, thread in threads if i in released],
+            self._target - time.perf_counter() + self.ready_timeout_s)
+        not_ready = [i for i in indices if i not in released]
+        if not_ready:
+            logging.error("LEDSync: show {0} started without devices that weren't ready: {1}"
+                .format(name, self._ports(not_ready)))
+
+        played = [i for i in range(count) if acted[i] is not None]
+        if played:
+            skew_ms = (max(acted[i] for i in played) - min(acted[i] for i in played)) * 1000.0
+            scheduled = [sent[i] + self.latency[i] for i in played]
+            send_jitter_ms = (max(scheduled) - min(scheduled)) * 1000.0
+        else:
+            skew_ms = None
+            send_jitter_ms = None
+        report = {
+            'show': name,
+            'skew_ms': skew_ms,
+            'within_target': skew_ms is not None and skew_ms <= self.target_skew_ms,
+            'send_jitter_ms': send_jitter_ms,
+            'offsets_ms': {
+                self.controllers[i].port: (acted[i] - self._target) * 1000.0 for i in played
+            },
+            'skipped': [self.controllers[i].port for i in range(count) if acted[i] is None],
+            'stuck': self._ports(sorted(self.busy)),
+        }
+        self.reports.append(report)
+        if report['within_target']:
+            logging.info("LEDSync: show {0} skew {1:.2f} ms.".format(name, skew_ms))
+        elif skew_ms is not None:
+            logging.warning("LEDSync: show {0} skew {1:.2f} ms is over the {2} ms target."
+                .format(name, skew_ms, self.target_skew_ms))
+        if report['skipped']:
+            logging.warning("LEDSync: show {0} skipped {1}.".format(name, report['skipped']))
+        return report
+
+    def available(self):
+        """Indices of the controllers with no thread still blocked on their serial link."""
+        for index, thread in list(self.busy.items()):
+            if not thread.is_alive():
+                del self.busy[index]
+                logging.info("LEDSync: {0} is responding again.".format(self.controllers[index].port))
+        return [i for i in range(len(self.controllers)) if i not in self.busy]
+
+    def _ports(self, indices):
+        return [self.controllers[i].port for i in indices]
+
+    def _wait_until(self, when):
+        delay = when - time.perf_counter() - self.SPIN_S
+        if delay > 0:
+            time.sleep(delay)
+        while time.perf_counter() < when:
+            time.sleep(0) # let the other devices' threads run
+
+    # Starts func(index, controller) on its own thread for each controller in indices. Returns
+    # a list of (index, thread).
+    def _start_all(self, func, indices):
+        threads = []
+        for i in indices:
+            controller = self.controllers[i]
+            thread = threading.Thread(target=func, args=(i, controller),
+                name='LEDSync-{0}'.format(controller.port), daemon=True)
+            thread.start()
+            threads.append((i, thread))
+        return threads
+
+    # Waits up to timeout seconds for the threads from _start_all. Any still running are blocked on
+    # their serial link - their controllers are marked busy (left out until the thread finishes).
+    # Returns the indices of those controllers.
+    def _join(self, threads, timeout):
+        deadline = time.perf_counter() + timeout
+        for _, thread in threads:
+            thread.join(max(0.0, deadline - time.perf_counter()))
+        stuck = [i for i, thread in threads if thread.is_alive()]
+        for i, thread in threads:
+            if thread.is_alive():
+                self.busy[i] = thread
+        return stuck
+
+
+# Demo show loop for a SyncGroup - wipes and theater chases started on all strips together.
+# Loops continuously - won't return.
+def run_sync_demo(group):
+    group.measure_latency()
+    while (True):
+        print(group.show('wipe', lambda c: c.setPatternWipe(0xFF0000, 2000)))
+        print(group.show('wipe back', lambda c: c.setPatternWipe(0x0000FF, 2000)))
+        print(group.show('theater', lambda c: c.setPatternTheater(0x000000, 0xFFFFFF, 6000)))
@@ -0,0 +1,278 @@
+#!python3
+# RenderPool.py
+# Host-side effect rendering spread across worker processes.
+#
+# INSTRUCTIONS FOR USE: (in general....)
+# Give the pool one (name, number of LEDs) entry per strip and an effect function. Each worker process
+# renders its share of the strips straight into a multiprocessing.shared_memory block per strip, and
+# the serial side picks frames up with latest_frame(), which hands back a memoryview onto the shared
+# block - nothing is pickled or copied on the way from the renderer to the serial writer.
+#
+# Effects are plain module level functions (so they can be sent to a worker process):
+#     effect(frame_number, num_leds, pixels)
+# where pixels is a writable memoryview of num_leds * 3 bytes, R G B per LED.
+#
+# Run this file directly to benchmark the pool against the number of CPU cores.
+
+import logging # Program logging
+import math # Effects
+import multiprocessing # Worker processes and shared statistics
+from multiprocessing import shared_memory
+import struct # Frame buffer header
+import time # for delays, etc.
+
+# Each strip's shared block holds a small header followed by three frame slots (triple buffering), so
+# the worker always has a slot to render into that is neither the newest published frame nor the frame
+# the serial writer is currently reading.
+#   header: uint64 sequence of the published frame, int64 published slot, int64 slot being read
+# Workers only ever write the first two fields and the serial side only the third.
+HEADER = struct.Struct('<Qqq')
+PUBLISH = struct.Struct('<Qq')
+READING = struct.Struct('<q')
+READING_OFFSET = PUBLISH.size
+SLOTS = 3
+
+
+# --- Effects ---
+
+# Rainbow that rolls along the strip, one hue step per frame.
+def rainbow_effect(frame, num_leds, pixels):
+    for i in range(num_leds):
+        pos = (i * 256 // num_leds + frame) & 0xFF
+        if pos < 85:
+            r, g, b = 255 - pos * 3, 0, pos * 3
+        elif pos < 170:
+            pos -= 85
+            r, g, b = 0, pos * 3, 255 - pos * 3
+        else:
+            pos -= 170
+            r, g, b = pos * 3, 255 - pos * 3, 0
+        pixels[i * 3] = r
+        pixels[i * 3 + 1] = g
+        pixels[i * 3 + 2] = b
+
+# Overlapping sine waves - deliberately heavy, used to benchmark the pool.
+def plasma_effect(frame, num_leds, pixels):
+    t = frame / 30.0
+    for i in range(num_leds):
+        x = i / num_leds
+        v = math.sin(x * 10.0 + t) + math.sin((x * 7.0 - t) * 1.3) + math.sin(math.sqrt(x * 50.0 + t))
+        pixels[i * 3] = int(127.5 + 127.5 * math.sin(v * math.pi))
+        pixels[i * 3 + 1] = int(127.5 + 127.5 * math.sin(v * math.pi + 2.094))
+        pixels[i * 3 + 2] = int(127.5 + 127.5 * math.sin(v * math.pi + 4.189))
+
+
+# --- Worker process ---
+
+# Worker frame statistics are kept locally and only written to the shared array this often, so the
+# workers are not all queueing on its lock once per strip frame.
+STATS_FLUSH_S = 0.25
+
+# Renders frames for the strips in devices until stop is set. devices is a list of
+# (shared memory name, number of LEDs). Frame times are accumulated into stats[worker * 2]
+# (seconds) and stats[worker * 2 + 1] (frames).
+def _render_worker(worker, devices, effect, fps, stop, stats):
+    blocks = [(shared_memory.SharedMemory(name=name), num_leds) for name, num_leds in devices]
+    frame = 0
+    period = 1.0 / fps if fps else 0
+    next_frame = time.perf_counter()
+    seconds = 0.0
+    frames = 0
+    next_flush = next_frame + STATS_FLUSH_S
+    try:
+        while not stop.is_set():
+            for shm, num_leds in blocks:
+                start = time.perf_counter()
+                sequence, published, reading = HEADER.unpack_from(shm.buf, 0)
+                slot = next(s for s in range(SLOTS) if s != published and s != reading)
+                offset = HEADER.size + slot * num_leds * 3
+                pixels = shm.buf[offset:offset + num_leds * 3]
+                try:
+                    effect(frame, num_leds, pixels)
+                finally:
+                    pixels.release()
+                PUBLISH.pack_into(shm.buf, 0, sequence + 1, slot)
+                seconds += time.perf_counter() - start
+                frames += 1
+            frame += 1
+            if time.perf_counter() >= next_flush:
+                _flush_stats(worker, stats, seconds, frames)
+                seconds = 0.0
+                frames = 0
+                next_flush = time.perf_counter() + STATS_FLUSH_S
+            if period:
+                next_frame += period
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.perf_counter() # fell behind - don't try to catch up
+    finally:
+        _flush_stats(worker, stats, seconds, frames)
+        for shm, _ in blocks:
+            shm.close()
+
+def _flush_stats(worker, stats, seconds, frames):
+    with stats.get_lock():
+        stats[worker * 2] += seconds
+        stats[worker * 2 + 1] += frames
+
+
+class RenderPool(object):
+    """Renders an effect for several strips across worker processes into shared memory.
+
+    devices: list of (name, number of LEDs)
+    effect: module level function effect(frame_number, num_leds, pixels)
+    workers: number of worker processes (defaults to the number of CPU cores, at most one per strip)
+    fps: frames per second each worker aims for, None to render as fast as possible
+    """
+
+    def __init__(self, devices, effect, workers=None, fps=None):
+        self.devices = list(devices)
+        self.effect = effect
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = max(1, min(workers, len(self.devices)))
+        self.fps = fps
+        self.blocks = {}
+        self.last_sequence = {}
+        self.views = {} # the frame view last handed out for each strip
+        self.strip_worker = {} # strip name -> index of the worker rendering it
+        self.processes = []
+        self.exitcodes = [None] * self.workers
+        self.stop_event = multiprocessing.Event()
+        self.stats = multiprocessing.Array('d', self.workers * 2)
+
+    def start(self):
+        """Create the shared frame buffers and start the worker processes."""
+        for name, num_leds in self.devices:
+            shm = shared_memory.SharedMemory(create=True, size=HEADER.size + SLOTS * num_leds * 3)
+            shm.buf[:] = bytes(shm.size)
+            HEADER.pack_into(shm.buf, 0, 0, -1, -1)
+            self.blocks[name] = (shm, num_leds)
+            self.last_sequence[name] = 0
+        # Strips are dealt out round robin so each worker gets an even share.
+        assignments = [[] for _ in range(self.workers)]
+        for i, (name, num_leds) in enumerate(self.devices):
+            assignments[i % self.workers].append((self.blocks[name][0].name, num_leds))
+            self.strip_worker[name] = i % self.workers
+        self.stop_event.clear()
+        self.exitcodes = [None] * self.workers
+        for worker, devices in enumerate(assignments):
+            process = multiprocessing.Process(
+                target=_render_worker,
+                args=(worker, devices, self.effect, self.fps, self.stop_event, self.stats),
+                name='RenderPool-{0}'.format(worker),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        logging.info("RenderPool started {0} workers for {1} strips.".format(self.workers, len(self.devices)))
+
+    def stop(self):
+        """Stop the workers and free the shared frame buffers."""
+        self.stop_event.set()
+        for worker, process in enumerate(self.processes):
+            process.join()
+            self.exitcodes[worker] = process.exitcode
+            if process.exitcode:
+                logging.error("RenderPool: worker {0} had died with exit code {1}.".format(worker, process.exitcode))
+        self.processes = []
+        for view in self.views.values():
+            view.release()
+        self.views = {}
+        for name, (shm, _) in self.blocks.items():
+            try:
+                shm.close()
+            except BufferError:
+                logging.warning("RenderPool: frame buffer for {0} is still in use, unlinking anyway.".format(name))
+            finally:
+                shm.unlink()
+        self.blocks = {}
+        logging.info("RenderPool stopped. {0}".format(self.worker_stats()))
+
+    def latest_frame(self, name):
+        """Returns a memoryview of the newest frame for strip name, or None if there is no new frame.
+
+        The view points straight into shared memory and stays valid (the workers will not write into
+        it) until the next latest_frame() call for the same strip, or stop(), which release it. Don't
+        keep slices or other views of it past that point.
+
+        Raises RuntimeError if the worker rendering the strip has died (eg. the effect raised), rather
+        than returning None for it forever."""
+        shm, num_leds = self.blocks[name]
+        while True:
+            sequence, published, reading = HEADER.unpack_from(shm.buf, 0)
+            if sequence == self.last_sequence[name] or published < 0:
+                self.check_worker(self.strip_worker[name])
+                return None
+            # Claim the slot, then make sure the worker did not publish over it in the meantime.
+            READING.pack_into(shm.buf, READING_OFFSET, published)
+            check_sequence, check_published, _ = HEADER.unpack_from(shm.buf, 0)
+            if check_published == published:
+                break
+        self.last_sequence[name] = check_sequence
+        if name in self.views:
+            self.views[name].release()
+        offset = HEADER.size + published * num_leds * 3
+        self.views[name] = shm.buf[offset:offset + num_leds * 3]
+        return self.views[name]
+
+    def check_worker(self, worker):
+        """Raise RuntimeError if worker has exited while the pool is running."""
+        if worker >= len(self.processes) or self.processes[worker].is_alive():
+            return
+        exitcode = self.processes[worker].exitcode
+        self.exitcodes[worker] = exitcode
+        logging.error("RenderPool: worker {0} died with exit code {1}.".format(worker, exitcode))
+        raise RuntimeError("RenderPool worker {0} died with exit code {1} - see its traceback on stderr."
+            .format(worker, exitcode))
+
+    def worker_stats(self):
+        """Per worker frame counts, average frame render time in milliseconds and whether the worker
+        is still running (exitcode is None while it is)."""
+        with self.stats.get_lock():
+            values = list(self.stats)
+        result = []
+        for worker in range(self.workers):
+            seconds, frames = values[worker * 2], values[worker * 2 + 1]
+            if worker < len(self.processes):
+                alive = self.processes[worker].is_alive()
+                exitcode = self.processes[worker].exitcode
+            else:
+                alive = False
+                exitcode = self.exitcodes[worker]
+            result.append({
+                'worker': worker,
+                'frames': int(frames),
+                'avg_frame_ms': (seconds / frames * 1000.0) if frames else 0.0,
+                'alive': alive,
+                'exitcode': exitcode,
+            })
+        return result
+
+
+def run_benchmark(strips=8, num_leds=300, seconds=3.0):
+    """Render the plasma effect for several strips with 1..cores workers and print the throughput."""
+    devices = [('strip{0}'.format(i), num_leds) for i in range(strips)]
+    baseline = None
+    workers = 1
+    while workers <= min(multiprocessing.cpu_count(), strips):
+        pool = RenderPool(devices, plasma_effect, workers=workers)
+        pool.start()
+        time.sleep(seconds)
+        consumed = sum(1 for name, _ in devices if pool.latest_frame(name) is not None)
+        stats = pool.worker_stats()
+        pool.stop()
+        frames = sum(s['frames'] for s in stats)
+        rate = frames / seconds
+        if baseline is None:
+            baseline = rate
+        print("{0} workers: {1:.0f} frames/s ({2:.2f}x), per worker ms/frame: {3}, strips with new frames: {4}"
+            .format(workers, rate, rate / baseline,
+                ', '.join('{0:.2f}'.format(s['avg_frame_ms']) for s in stats), consumed))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,179 @@
+import socket
+import time
+
+import pytest
+
+from DMXBridge import (DMXBridge, DMXParameterMap, build_artnet_packet, build_sacn_packet,
+    brightness_from_desk, DMX_CHANNELS)
+
+
+def wait_for_frame(bridge, universe, out, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        length = bridge.take_frame(universe, out)
+        if length:
+            return length
+        time.sleep(0.01)
+    return 0
+
+
+def wait_for_packets(bridge, packets, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while bridge.packets < packets and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def sender():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield sock
+    sock.close()
+
+
+@pytest.mark.parametrize('protocol, build', [('sacn', build_sacn_packet), ('artnet', build_artnet_packet)])
+def test_loopback_keeps_latest_frame(protocol, build, sender):
+    bridge = DMXBridge(protocol, universes=(1,), address='127.0.0.1', port=0)
+    bridge.start()
+    try:
+        for sequence in range(1, 6):
+            sender.sendto(build(1, sequence, bytes([sequence]) * DMX_CHANNELS), ('127.0.0.1', bridge.port))
+        wait_for_packets(bridge, 5)
+        out = bytearray(DMX_CHANNELS)
+        assert wait_for_frame(bridge, 1, out) == DMX_CHANNELS
+        assert out == bytes([5]) * DMX_CHANNELS
+        stats = bridge.stats()
+        assert stats['packets'] == 5
+        assert stats['dropped'] == 0
+        assert stats['merged'] == 4
+        assert bridge.take_frame(1, out) == 0 # nothing new since
+    finally:
+        bridge.stop()
+
+
+def test_sacn_short_universe_length(sender):
+    bridge = DMXBridge('sacn', universes=(7,), address='127.0.0.1', port=0)
+    bridge.start()
+    try:
+        sender.sendto(build_sacn_packet(7, 1, bytes(range(24))), ('127.0.0.1', bridge.port))
+        out = bytearray(DMX_CHANNELS)
+        assert wait_for_frame(bridge, 7, out) == 24
+        assert out[:24] == bytes(range(24))
+    finally:
+        bridge.stop()
+
+
+def test_sacn_pdu_lengths():
+    packet = build_sacn_packet(1, 0, bytes(DMX_CHANNELS))
+    assert len(packet) == 638
+    assert (packet[16] & 0x0F) << 8 | packet[17] == 622
+    assert (packet[38] & 0x0F) << 8 | packet[39] == 600
+    assert (packet[115] & 0x0F) << 8 | packet[116] == 523
+
+
+def feed(bridge, packet):
+    bridge._buffer[:len(packet)] = packet
+    return bridge.handle_packet(len(packet))
+
+
+@pytest.mark.parametrize('offset', [17, 39, 116])
+def test_sacn_bad_pdu_length_dropped(offset):
+    bridge = DMXBridge('sacn', universes=(1,))
+    packet = bytearray(build_sacn_packet(1, 0, bytes(DMX_CHANNELS)))
+    packet[offset] += 1
+    assert not feed(bridge, packet)
+    assert bridge.stats()['dropped'] == 1
+
+
+def test_unwanted_universe_and_late_packets_dropped():
+    bridge = DMXBridge('sacn', universes=(1,))
+    assert not feed(bridge, build_sacn_packet(2, 0, bytes(8)))
+    assert feed(bridge, build_sacn_packet(1, 10, bytes(8)))
+    assert not feed(bridge, build_sacn_packet(1, 9, bytes(8)))
+    assert feed(bridge, build_sacn_packet(1, 11, bytes(8)))
+    assert feed(bridge, build_sacn_packet(1, 40, bytes(8)))
+    assert bridge.stats()['dropped'] == 2
+    assert bridge.stats()['merged'] == 2
+
+
+def test_artnet_sequence_zero_is_unsequenced():
+    bridge = DMXBridge('artnet', universes=(1,))
+    assert feed(bridge, build_artnet_packet(1, 10, bytes(8)))
+    assert feed(bridge, build_artnet_packet(1, 0, bytes(8)))
+    assert not feed(bridge, bytearray(b'Art-Poll\x00' + bytes(20)))
+
+
+def test_artnet_oversize_length_dropped():
+    bridge = DMXBridge('artnet', universes=(1,))
+    packet = bytearray(build_artnet_packet(1, 1, bytes(DMX_CHANNELS)))
+    packet[16:18] = (600).to_bytes(2, 'big')
+    assert not feed(bridge, packet)
+    assert bridge.stats()['dropped'] == 1
+
+
+class FakeController(object):
+    def __init__(self):
+        self.cmd_parameters = {'brightness': 0}
+        self.commands = []
+        self.brightness = []
+
+    def set_command(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        self.cmd_parameters.update(kwargs)
+
+    def set_brightness(self, brightness):
+        self.brightness.append(brightness)
+
+
+def desk_frame(brightness, pattern=0, color1=(255, 0, 0)):
+    data = bytearray(DMX_CHANNELS)
+    data[0:3] = bytes(color1)
+    data[6] = brightness
+    data[7] = pattern
+    data[8] = 0xFF
+    data[9] = 0xFF
+    return data
+
+
+def test_brightness_from_desk():
+    assert brightness_from_desk(0) == 1 # dimmest
+    assert brightness_from_desk(128) == 129
+    assert brightness_from_desk(255) == 0 # firmware's full brightness
+
+
+def test_parameter_map():
+    now = [0.0]
+    mapping = DMXParameterMap(1, 60000, clock=lambda: now[0])
+    controller = FakeController()
+    assert mapping.apply(controller, desk_frame(0, pattern=255), DMX_CHANNELS)
+    assert controller.commands == ['SLO']
+    assert controller.cmd_parameters['color1'] == 0xFF0000
+    assert controller.cmd_parameters['interval'] == 60000
+    assert controller.brightness == [1]
+    assert not mapping.apply(controller, desk_frame(0, pattern=255), DMX_CHANNELS)
+
+
+def test_parameter_map_throttles_brightness():
+    now = [0.0]
+    mapping = DMXParameterMap(1, 60000, clock=lambda: now[0])
+    controller = FakeController()
+    for value in range(0, 200, 10): # fader moving
+        now[0] += 0.05
+        mapping.apply(controller, desk_frame(value), DMX_CHANNELS)
+    assert controller.brightness == [1]
+    # Desk holds the fader - the newest value goes out once the hold time is up.
+    now[0] += DMXParameterMap.BRIGHTNESS_HOLD_S
+    mapping.apply(controller, desk_frame(190), DMX_CHANNELS)
+    assert controller.brightness == [1, 191]
+    now[0] += DMXParameterMap.BRIGHTNESS_HOLD_S
+    mapping.apply(controller, desk_frame(190), DMX_CHANNELS)
+    assert controller.brightness == [1, 191]
+    mapping.apply(controller, desk_frame(10), DMX_CHANNELS)
+    assert controller.brightness == [1, 191, 11]
+    # Fader moves away and back to the value already sent within the hold time - nothing goes out.
+    now[0] += 0.05
+    mapping.apply(controller, desk_frame(20), DMX_CHANNELS)
+    now[0] += 0.05
+    mapping.apply(controller, desk_frame(10), DMX_CHANNELS)
+    now[0] += DMXParameterMap.BRIGHTNESS_HOLD_S
+    mapping.apply(controller, desk_frame(10), DMX_CHANNELS)
+    assert controller.brightness == [1, 191, 11]
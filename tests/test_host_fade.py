@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+import LEDController as led
+from FakeArduino import FakeArduino
+from HostFade import DitheredFade
+
+
+def test_numpy_integer_colors():
+    fade = DitheredFade(np.int64(0x102030), np.uint32(0x000000), 1000)
+    fade.start(0.0)
+    assert fade.render_color(0.0) == 0x102030
+    assert fade.render_color(1.0) == 0x000000
+
+
+def test_dithering_averages_between_levels():
+    fade = DitheredFade(0x020202, 0x010101, 1000)
+    fade.start(0.0)
+    held = [int(fade.render(0.3)[0][0]) for _ in range(1000)]
+    assert set(held) == {1, 2}
+    assert abs(sum(held) / len(held) - 1.7) < 0.01
+
+
+def test_no_dithering_holds_nearest_level():
+    fade = DitheredFade(0x020202, 0x010101, 1000)
+    fade.dither = False
+    fade.start(0.0)
+    held = {int(fade.render(0.3)[0][0]) for _ in range(100)}
+    assert held == {2}
+
+
+def run_smooth_fade(baud, seconds=0.5, interval=1000):
+    controller = led.LEDController(0, 'fake', baud, 60, 0)
+    device = FakeArduino(controller.commands, LEDs=60, baud_rate=baud)
+    controller.setupCmdMessenger(device)
+    controller.set_command('SFD', color1=0x101010, color2=0x000000, interval=interval)
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if controller.serial_has_waiting():
+            controller.repeat()
+    return controller, device
+
+
+def test_smooth_fade_dithers_only_on_a_fast_link():
+    fast, device = run_smooth_fade(115200)
+    assert fast.host_fade_fps > fast.MIN_DITHER_FPS
+    assert fast.host_fade.dither
+    assert all(cmd == 'SETCOLORALL' for cmd, _ in device.received)
+    slow, _ = run_smooth_fade(9600)
+    assert slow.host_fade_fps < slow.MIN_DITHER_FPS
+    assert not slow.host_fade.dither
+
+
+def test_smooth_fade_zero_interval_holds_color2():
+    _, device = run_smooth_fade(115200, seconds=0.1, interval=0)
+    colors = {args[0] for cmd, args in device.received if cmd == 'SETCOLORALL'}
+    assert colors == {0x000000}
+
+
+def test_poll_interval():
+    controller = led.LEDController(0, 'fake', 115200, 60, 0)
+    assert controller.poll_interval() == controller.POLL_MS
+    controller.set_command('SFD')
+    assert controller.poll_interval() == controller.HOST_FADE_POLL_MS
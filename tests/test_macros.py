@@ -0,0 +1,185 @@
+import logging
+
+import pytest
+
+import LEDController as led
+from DMXBridge import DMXParameterMap, DMX_CHANNELS
+from FakeArduino import FakeArduino
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_controller(clock, macros=True):
+    controller = led.LEDController(0, 'fake', 115200, 60, 0, macros)
+    device = FakeArduino(controller.commands, LEDs=60, clock=clock)
+    controller.setupCmdMessenger(device)
+    controller.set_command('Breathe', color1=0xFF0000, color2=0x000000, interval=1000)
+    return controller, device
+
+
+def names(messages):
+    return [cmd for cmd, _ in messages]
+
+
+def test_breathe_macro_upload_run_interrupt(clock):
+    controller, device = make_controller(clock)
+    controller.repeat()
+    assert names(device.received) == ['DEFINEMACRO', 'MACROSTEP', 'MACROSTEP', 'RUNMACRO']
+    assert device.macros[0]['loop']
+    assert device.macros[0]['steps'] == [
+        ('SETPATTERNFADE', (0xFF0000, 0x000000, 100, 10)),
+        ('SETPATTERNFADE', (0x000000, 0xFF0000, 100, 10)),
+    ]
+    assert device.playing == 0
+
+    # The device plays both fades in turn without asking the host for anything.
+    traffic = device.bytes_received + device.bytes_sent
+    for _ in range(11):
+        clock.now += 0.5
+        assert not controller.serial_has_waiting()
+        assert not controller.macro_interrupted()
+    assert device.bytes_received + device.bytes_sent == traffic
+    assert names(device.shown) == ['SETPATTERNFADE'] * 6
+    assert device.shown[4] == device.shown[0]
+    assert device.shown[5] == device.shown[1]
+
+    # Picking something else in the UI takes the strip straight back.
+    controller.set_command('SPR')
+    assert controller.macro_interrupted()
+    controller.interrupt_macro()
+    assert device.playing is None
+    assert device.received[-1][0] == 'SETPATTERNRAINBOW'
+    assert not controller.macro_interrupted()
+
+
+def test_breathe_macro_only_reuploads_on_change(clock):
+    controller, device = make_controller(clock)
+    controller.repeat()
+    controller.set_command('Breathe', color1=0x00FF00)
+    controller.interrupt_macro()
+    assert names(device.received)[4:] == ['DEFINEMACRO', 'MACROSTEP', 'MACROSTEP', 'RUNMACRO']
+    assert device.macros[0]['steps'][0][1][0] == 0x00FF00
+    controller.set_command('SLO')
+    controller.interrupt_macro()
+    clock.now += 2.0
+    controller.set_command('Breathe')
+    controller.repeat()
+    assert names(device.received)[-1:] == ['RUNMACRO']
+    assert device.playing == 0
+
+
+def test_rejected_macro_falls_back_to_per_step(clock):
+    controller, device = make_controller(clock)
+    device.MAX_MACROS = 0 # firmware that rejects every macro
+    controller.repeat()
+    assert names(device.received) == ['DEFINEMACRO', 'SETPATTERNFADE']
+    assert controller.macro_running is None
+    assert controller.macros == {}
+    assert not controller.macros_enabled
+    # The strip keeps breathing: the device asks again once the fade has run.
+    clock.now += 1.0
+    assert controller.serial_has_waiting()
+    controller.repeat()
+    assert names(device.received)[-1:] == ['SETPATTERNFADE']
+    assert device.received[-1][1][0] == 0x000000
+
+
+def test_rejected_macro_run_falls_back_to_per_step(clock):
+    controller, device = make_controller(clock)
+    controller.repeat()
+    assert device.playing == 0
+    device.macros.clear() # eg. the device was reset
+    controller.set_command('SLO')
+    controller.interrupt_macro()
+    clock.now += 1.0
+    controller.set_command('Breathe')
+    controller.repeat()
+    assert names(device.received)[-2:] == ['RUNMACRO', 'SETPATTERNFADE']
+    assert controller.macro_running is None
+    assert controller.macros == {}
+
+
+def test_macro_traffic_matches_device(clock):
+    controller, device = make_controller(clock, macros=False)
+    compiled = controller.compileMacro(
+        lambda: controller.setPatternFade(0xFF0000, 0x000000, 100, 1000),
+        lambda: controller.setPatternFade(0x000000, 0xFF0000, 100, 1000),
+    )
+    traffic = controller.macro_traffic(0, compiled)
+    # Per step: one pass of Breathe sent the old way.
+    controller.repeat()
+    clock.now += 1.0
+    controller.repeat()
+    assert device.bytes_received + device.bytes_sent == traffic['per_step_bytes']
+    assert traffic['pass_s'] == 2.0
+    assert traffic['per_step_bytes_per_s'] == traffic['per_step_bytes'] / 2.0
+
+    controller, device = make_controller(Clock(), macros=True)
+    controller.repeat()
+    assert device.bytes_received + device.bytes_sent == traffic['upload_bytes']
+
+
+def test_compile_rejects_primitives_with_side_effects(clock):
+    controller, device = make_controller(clock, macros=False)
+    with pytest.raises(ValueError):
+        controller.compileMacro(lambda: controller.setBrightness(10))
+    assert controller.last_command_lambda == 'Breathe'
+    assert controller.brightness_set_cycle
+    with pytest.raises(ValueError):
+        controller.compileMacro(lambda: controller.breathe_effect())
+    assert controller.last_cycle == 0
+    assert device.received == []
+
+
+class DeskBridge(object):
+    def __init__(self, data):
+        self.data = data
+
+    def take_frame(self, universe, out):
+        if self.data is None:
+            return 0
+        out[:DMX_CHANNELS] = self.data
+        self.data = None
+        return DMX_CHANNELS
+
+    def stats(self):
+        return {'packets': 1, 'dropped': 0, 'merged': 0}
+
+
+class App(object):
+    def after(self, ms, func):
+        self.next_ms = ms
+
+
+def test_desk_change_interrupts_macro(clock, monkeypatch, caplog):
+    controller, device = make_controller(clock)
+    controller.repeat()
+    assert device.playing == 0
+    data = bytearray(DMX_CHANNELS)
+    data[7] = 70 # pattern band 2 - rainbow
+    data[8] = 0x10
+    monkeypatch.setattr(led, 'LEDController', controller)
+    monkeypatch.setattr(led, 'app', App())
+    monkeypatch.setattr(led, 'dmx_bridge', DeskBridge(data))
+    monkeypatch.setattr(led, 'dmx_map', DMXParameterMap(1, controller.MAX_INTERVAL, clock=clock))
+    monkeypatch.setattr(led, 'dmx_stats_due', 0.0)
+    caplog.set_level(logging.INFO)
+    led.update_controller()
+    assert device.playing is None
+    assert device.received[-1] == ('SETBRIGHTNESSALL', (1,)) # desk brightness goes first
+    led.update_controller()
+    assert device.received[-1][0] == 'SETPATTERNRAINBOW'
+    # Bridge counters are logged while it runs, not only on shutdown - once per interval.
+    assert [r.getMessage() for r in caplog.records if r.getMessage().startswith('DMXBridge:')] == \
+        ["DMXBridge: {'packets': 1, 'dropped': 0, 'merged': 0}"]
@@ -0,0 +1,78 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+import pytest
+
+import RenderPool
+from RenderPool import RenderPool as Pool, rainbow_effect
+
+
+def wait_for_frame(pool, name, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        frame = pool.latest_frame(name)
+        if frame is not None:
+            return frame
+        time.sleep(0.01)
+    return None
+
+
+def test_frames_and_stop_with_view_held():
+    pool = Pool([('a', 10), ('b', 20)], rainbow_effect, workers=2, fps=200)
+    pool.start()
+    try:
+        frame = wait_for_frame(pool, 'a')
+        assert frame is not None
+        assert len(frame) == 30
+        assert wait_for_frame(pool, 'b') is not None
+    finally:
+        pool.stop() # must not fail with the view still held
+    with pytest.raises(ValueError):
+        frame[0]
+    stats = pool.worker_stats()
+    assert len(stats) == 2
+    assert all(worker['frames'] > 0 for worker in stats)
+
+
+def test_latest_frame_releases_previous_view():
+    pool = Pool([('a', 10)], rainbow_effect, workers=1, fps=200)
+    pool.start()
+    try:
+        first = wait_for_frame(pool, 'a')
+        second = wait_for_frame(pool, 'a')
+        assert second is not None
+        with pytest.raises(ValueError):
+            first[0]
+    finally:
+        pool.stop()
+
+
+def broken_effect(frame, num_leds, pixels):
+    raise ZeroDivisionError('effect failed')
+
+
+def test_worker_effect_error_is_not_masked():
+    shm = shared_memory.SharedMemory(create=True, size=RenderPool.HEADER.size + RenderPool.SLOTS * 3)
+    try:
+        RenderPool.HEADER.pack_into(shm.buf, 0, 0, -1, -1)
+        stats = multiprocessing.Array('d', 2)
+        with pytest.raises(ZeroDivisionError):
+            RenderPool._render_worker(0, [(shm.name, 1)], broken_effect, None, multiprocessing.Event(), stats)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_dead_worker_is_reported():
+    pool = Pool([('a', 10), ('b', 10)], broken_effect, workers=2, fps=200)
+    pool.start()
+    try:
+        with pytest.raises(RuntimeError):
+            wait_for_frame(pool, 'a')
+        stats = pool.worker_stats()
+        assert not stats[0]['alive']
+        assert stats[0]['exitcode'] == 1
+    finally:
+        pool.stop()
+    assert [worker['exitcode'] for worker in pool.worker_stats()] == [1, 1]
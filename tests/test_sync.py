@@ -0,0 +1,115 @@
+import threading
+import time
+
+from LEDSync import SyncGroup
+
+
+class FakeController(object):
+    """Stands in for LEDController - replies after a fixed link latency."""
+
+    def __init__(self, port, latency, device_delay=0.0, ready=True, error=None, block=None):
+        self.port = port
+        self.latency = latency
+        self.device_delay = device_delay
+        self.ready = ready
+        self.error = error
+        self.block = block
+        self.reply_time = None
+        self.acted = None
+
+    def arduino_ready(self, trace):
+        if self.block is not None:
+            self.block.wait()
+        if self.error is not None:
+            raise self.error
+        return self.ready
+
+    def setNoCmd(self):
+        time.sleep(2 * self.latency)
+        self.reply_time = time.perf_counter()
+
+    def setPatternWipe(self, color, update_ms):
+        self.acted = time.perf_counter() + self.latency + self.device_delay
+        time.sleep(2 * self.latency + self.device_delay)
+        self.reply_time = time.perf_counter()
+
+
+def wipe(controller):
+    controller.setPatternWipe(0xFF0000, 1000)
+
+
+def test_measure_latency():
+    group = SyncGroup([FakeController('A', 0.002), FakeController('B', 0.010)])
+    latency = group.measure_latency(samples=3)
+    assert 1.5 < latency['A'] < 5.0
+    assert 9.5 < latency['B'] < 15.0
+
+
+def test_show_lands_together():
+    devices = [FakeController('A', 0.002), FakeController('B', 0.015)]
+    group = SyncGroup(devices, target_skew_ms=10.0)
+    group.measure_latency(samples=3)
+    report = group.show('wipe', wipe)
+    assert report['skipped'] == []
+    assert abs(devices[0].acted - devices[1].acted) < 0.010
+    assert report['within_target']
+
+
+def test_show_reports_device_skew():
+    # B is slow to act on the command - the schedule can't see that, the confirmation can.
+    devices = [FakeController('A', 0.002), FakeController('B', 0.002, device_delay=0.040)]
+    group = SyncGroup(devices, target_skew_ms=5.0)
+    group.measure_latency(samples=3)
+    report = group.show('wipe', wipe)
+    assert report['skew_ms'] > 30.0
+    assert report['send_jitter_ms'] < report['skew_ms']
+    assert not report['within_target']
+
+
+def test_not_ready_and_failed_devices_are_skipped():
+    devices = [
+        FakeController('A', 0.001),
+        FakeController('B', 0.001, ready=False),
+        FakeController('C', 0.001, error=IOError('port gone')),
+    ]
+    report = SyncGroup(devices).show('wipe', wipe)
+    assert report['skipped'] == ['B', 'C']
+    assert devices[0].acted is not None
+    assert devices[1].acted is None
+
+
+def test_stuck_device_does_not_hang_show():
+    block = threading.Event()
+    devices = [FakeController('A', 0.001), FakeController('B', 0.001, block=block)]
+    group = SyncGroup(devices, ready_timeout_s=0.2)
+    try:
+        report = group.show('wipe', wipe)
+        # The healthy strip still plays, and B's blocked thread keeps it out of the next show.
+        assert devices[0].acted is not None
+        assert report['skipped'] == ['B']
+        assert report['stuck'] == ['B']
+        devices[0].acted = None
+        start = time.perf_counter()
+        report = group.show('wipe', wipe)
+        assert time.perf_counter() - start < 0.2 # B isn't waited on again
+        assert devices[0].acted is not None
+        assert report['skipped'] == ['B']
+    finally:
+        block.set()
+    group.busy[1].join(1.0)
+    assert group.available() == [0, 1]
+
+
+def test_stuck_device_does_not_hang_latency_ping():
+    block = threading.Event()
+    devices = [FakeController('A', 0.002), FakeController('B', 0.002, block=block)]
+    group = SyncGroup(devices, ready_timeout_s=0.2)
+    try:
+        start = time.perf_counter()
+        latency = group.measure_latency(samples=3)
+        assert time.perf_counter() - start < 2.0
+        assert 1.5 < latency['A'] < 5.0
+        assert latency['B'] == 0.0
+        assert group.available() == [0]
+    finally:
+        block.set()